@@ -0,0 +1,136 @@
+# Indicator data aligned on calendar periods.
+# AlignedIndicators holds, for each time resolution used in correlations (month and
+# quarter), a (periods x indicators) array covering the range of definitions file,
+# labelled by period index (see utils.period_index). Differences (the "diff" entry of
+# definitions file) are already applied. It is also a mapping from indicator to its
+# series, so it can be used wherever a dictionary of indicator data is expected, and
+# it is built once and sent to workers as is:
+#   aligned = align_indicators()
+#   aligned.matrix("month")              # (indicators x months) array for correlations
+#   aligned.to_frame("quarter")          # dataframe indexed by quarter
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+import numpy as np
+
+import definitions as dfn
+import utils as u
+
+periods = ["month", "quarter"]
+
+
+# Time resolution used to correlate an indicator: daily and monthly indicators
+# are aggregated by month, quarterly ones by quarter.
+def indicator_period(indicator):
+    return "quarter" if dfn.indicators[indicator]["time"] == "quarter" else "month"
+
+# Stock window [start, stop) of period indices for a lag in months, for an indicator
+# window starting at period index first and n periods long. Follows apply_lag_in_months
+# and apply_lag_in_quarters: for a lag of L months (L / 3 + 1 quarters), the window is
+# shifted by L periods, with one extra period at the start when looking at differences.
+def lag_window(period, lag, diff, first, n):
+    period_lag = lag if period == "month" else lag // 3 + 1
+    return first + period_lag - int(bool(diff)), first + period_lag + n
+
+# Periods [start, stop) given as period indices, as (start_year, start_period, end_year, end_period)
+# with inclusive ends, the arguments of utils.get_stock_period_data.
+def period_range(period, start, stop):
+    n_periods = u.periods_per_year[period]
+    return start // n_periods, start % n_periods + 1, (stop - 1) // n_periods, (stop - 1) % n_periods + 1
+
+
+class AlignedIndicators(Mapping):
+
+    # data: dictionary of indicator to its series over the years [start_year, end_year],
+    # monthly or quarterly as given by indicator_period.
+    def __init__(self, data, start_year, end_year):
+        self.start_year = start_year
+        self.end_year = end_year
+        self.indicators = sorted(data.keys())
+        self.columns = {}
+        self.first = {}
+        self.values = {}
+        self._matrix = {}
+        for period in periods:
+            n_periods = u.periods_per_year[period]
+            n = (end_year - start_year + 1) * n_periods
+            columns = [ind for ind in self.indicators if indicator_period(ind) == period]
+            values = np.empty((n, len(columns)))
+            for i, ind in enumerate(columns):
+                series = np.asarray(data[ind], dtype = np.float64)
+                if len(series) != n:
+                    raise ValueError("Expecting %d %s values for indicator %s, got %d." % \
+                            (n, period, ind, len(series)))
+                values[:, i] = series
+            self.columns[period] = columns
+            self.first[period] = start_year * n_periods
+            self.values[period] = values
+            # Rows of indicators, as used by the correlation kernels.
+            self._matrix[period] = np.ascontiguousarray(values.T)
+
+    def __getitem__(self, indicator):
+        period = indicator_period(indicator)
+        return self.values[period][:, self.columns[period].index(indicator)]
+
+    def __iter__(self):
+        return iter(self.indicators)
+
+    def __len__(self):
+        return len(self.indicators)
+
+    # Number of periods, and period indices of the rows.
+    def n_periods(self, period):
+        return self.values[period].shape[0]
+
+    def period_indices(self, period):
+        return self.first[period] + np.arange(self.n_periods(period))
+
+    # (indicators x periods) array for the given indicators of this period (all by default),
+    # in the order given.
+    def matrix(self, period, indicators = None):
+        if indicators is None or list(indicators) == self.columns[period]:
+            return self._matrix[period]
+        return self._matrix[period][[self.columns[period].index(ind) for ind in indicators]]
+
+    # Labels of the rows, such as 2010-01 or 2010Q1.
+    def period_labels(self, period):
+        index = self.period_indices(period)
+        n_periods = u.periods_per_year[period]
+        if period == "month":
+            return ["%d-%02d" % (p // n_periods, p % n_periods + 1) for p in index]
+        return ["%dQ%d" % (p // n_periods, p % n_periods + 1) for p in index]
+
+    # Dataframe of the indicators of a period, one column per indicator (named by its
+    # df column), indexed by period.
+    def to_frame(self, period):
+        import pandas as pd
+        index = pd.PeriodIndex(self.period_labels(period), freq = "M" if period == "month" else "Q")
+        return pd.DataFrame(self.values[period], index = index, \
+                columns = [dfn.indicators[ind]["df column"] for ind in self.columns[period]])
+
+
+# Aligned data of the indicators of definitions file (or the given dictionary of
+# indicator definitions) over the years [start_year, end_year], by default the range
+# of definitions file. Series are read with get_indicator_data, so they come from the
+# on-disk cache when possible. With allow_missing, missing periods are NaN.
+def align_indicators(indicators = None, start_year = None, end_year = None, allow_missing = False):
+    from indicator_correlation import get_indicator_data
+    indicators = dfn.indicators if indicators is None else indicators
+    start_year = dfn.start_year if start_year is None else start_year
+    end_year = dfn.end_year if end_year is None else end_year
+    data = dict((ind, get_indicator_data(indicators[ind], start_year, end_year, allow_missing)) \
+            for ind in indicators.keys())
+    return AlignedIndicators(data, start_year, end_year)
+
+# AlignedIndicators for a dictionary of indicator data over the range of definitions file,
+# or the data itself if already aligned.
+def as_aligned(indicator_data):
+    if isinstance(indicator_data, AlignedIndicators):
+        return indicator_data
+    if hasattr(indicator_data, "aligned"):
+        return indicator_data.aligned()
+    return AlignedIndicators(dict((ind, indicator_data[ind]) for ind in indicator_data.keys()), \
+            dfn.start_year, dfn.end_year)
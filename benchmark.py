@@ -0,0 +1,373 @@
+# Timing runs and regression checks for the correlation pipeline.
+# Run from a folder that contains the data folder described in data/readme.txt, e.g.:
+#   python benchmark.py scaling --workers 1 2 4 8 --lag 1
+#   python benchmark.py regression --stocks 50 --lag 1
+#   python benchmark.py startup
+# The suite generates its own synthetic data (see synthetic.py), times each stage of
+# the pipeline with its peak memory, and writes the results as JSON:
+#   python benchmark.py suite --tickers 500 --years 10 --out bench.json --compare old_bench.json
+# Full and mini-batch Kmeans are compared on synthetic clustered features:
+#   python benchmark.py kmeans --rows 50000 --features 100 --clusters 10
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import instrument
+
+
+# ********** Scaling of the S&P 500 correlation run with the number of workers **********
+
+def time_correlations_sp_500(n_workers, lag, diff = False):
+    import indicator_correlation as ind
+    start = time.time()
+    df, failures = ind.get_correlations_sp_500(ind.indicator_data, lag, diff, n_workers = n_workers)
+    return time.time() - start, len(df), len(failures)
+
+def run_scaling(worker_counts, lag, diff = False):
+    # End-to-end timing of a full S&P run for each worker count, with speedup
+    # relative to the first (usually serial) run.
+    results = []
+    for n_workers in worker_counts:
+        elapsed, n_rows, n_failures = time_correlations_sp_500(n_workers, lag, diff)
+        results.append({"workers": n_workers, "seconds": elapsed, "stocks": n_rows,
+                "failures": n_failures, "speedup": results[0]["seconds"] / elapsed if results else 1.0})
+        print("%3d workers: %8.2f s  %5d stocks  %4d failures  speedup %.2fx" % (n_workers,
+                elapsed, n_rows, n_failures, results[-1]["speedup"]))
+    return results
+
+
+# ********** Regression check of the batched correlation kernel **********
+
+def _difference(expected, got):
+    # Absolute difference, infinite when only one of the values is NaN.
+    if np.isnan(expected) or np.isnan(got):
+        return 0.0 if np.isnan(expected) and np.isnan(got) else np.inf
+    return abs(expected - got)
+
+def check_correlation_kernel(stocks, lag, diff = False, tolerance = 1e-10):
+    # Compare the batched correlations of get_correlations with one np.corrcoef call
+    # per stock and indicator, as computed before the batched kernel. Also compare the
+    # masked kernel with per-pair correlations over the periods both series have data.
+    import correlation as corr
+    import indicator_correlation as ind
+    import definitions as dfn
+    indicator_data = ind.indicator_data
+    df, failures = ind.get_correlations(stocks, indicator_data, lag, diff, n_workers = 1)
+    worst = 0.0
+    for _, row in df.iterrows():
+        monthly, quarterly = ind.get_stock_data_for_correlation(row.Name, lag, diff)
+        for indicator in indicator_data.keys():
+            stock_data = quarterly if corr.indicator_period(indicator) == "quarter" else monthly
+            expected = np.corrcoef(stock_data, indicator_data[indicator])[0][1]
+            worst = max(worst, _difference(expected, row[dfn.indicators[indicator]["df column"]]))
+
+    rng = np.random.RandomState(0)
+    x = rng.randn(20, 50)
+    y = rng.randn(5, 50)
+    x[rng.rand(20, 50) < 0.2] = np.nan
+    masked = corr.masked_corr_matrix(x, y)
+    for i in range(x.shape[0]):
+        for j in range(y.shape[0]):
+            valid = ~np.isnan(x[i]) & ~np.isnan(y[j])
+            worst = max(worst, _difference(np.corrcoef(x[i][valid], y[j][valid])[0][1], masked[i, j]))
+
+    print("Checked %d stocks, max difference %.3g" % (len(df), worst))
+    return worst <= tolerance
+
+
+# ********** Start-up time of the analysis modules **********
+
+# Statements run in a fresh interpreter, as a notebook or a batch worker would.
+startup_scenarios = [
+    ("import indicator_correlation", "import indicator_correlation"),
+    ("import clustering_analysis", "import clustering_analysis"),
+    ("headless worker", "import indicator_correlation as ind; ind.load_indicators(); " \
+            "ind.get_stock_data_for_correlation(%(stock)r, 1)"),
+]
+heavy_modules = ["pandas", "matplotlib", "seaborn", "sklearn", "scipy"]
+
+def time_startup(statement, repeats = 5):
+    # Median wall time of a fresh interpreter running statement, and the heavy
+    # modules that were loaded.
+    code = "%s\nimport sys\nprint(','.join(m for m in %r if m in sys.modules))" % (statement, heavy_modules)
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([os.path.dirname(os.path.abspath(__file__))] + \
+            [p for p in [env.get("PYTHONPATH")] if p])
+    times = []
+    for i in range(repeats):
+        start = time.time()
+        output = subprocess.check_output([sys.executable, "-c", code], env = env)
+        times.append(time.time() - start)
+    loaded = output.decode("utf-8").strip().split("\n")[-1]
+    return float(np.median(times)), [m for m in loaded.split(",") if m]
+
+def run_startup(repeats = 5):
+    import indicator_correlation as ind
+    stock = ind.get_sp_500_stocks()[0]
+    results = []
+    for name, statement in startup_scenarios:
+        elapsed, loaded = time_startup(statement % {"stock" : stock}, repeats)
+        results.append({"scenario" : name, "seconds" : elapsed, "modules" : loaded})
+        print("%-30s %6.3f s  loads: %s" % (name, elapsed, ", ".join(loaded) or "-"))
+    return results
+
+
+# ********** Benchmark suite on synthetic data **********
+
+# Peak resident memory of this process and its finished children, in MB.
+def peak_rss_mb():
+    import resource
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere.
+    return peak / (2.0 ** 20 if sys.platform == "darwin" else 1024.0)
+
+def _run_stage_in_child(func, queue):
+    start_rss = peak_rss_mb()
+    start = time.time()
+    try:
+        info = func() or {}
+        error = None
+    except Exception as e:
+        info = {}
+        error = "%s: %s" % (type(e).__name__, e)
+    queue.put({"seconds" : time.time() - start, "peak_rss_mb" : peak_rss_mb(),
+            "start_rss_mb" : start_rss, "error" : error, "info" : info})
+
+# Run a stage in a fresh child process, so its peak memory is measured on its own.
+def run_stage(name, func):
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target = _run_stage_in_child, args = (func, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    result["name"] = name
+    print("%-40s %8.3f s  peak %7.1f MB%s" % (name, result["seconds"], result["peak_rss_mb"],
+            "  FAILED: " + result["error"] if result["error"] else ""))
+    return result
+
+def _stage_mean_year_month(repeats = 20):
+    import pandas as pd
+    import definitions as dfn
+    import utils as u
+    df = pd.read_csv("data/indicators/%s" % dfn.indicators["BOND_RATE"]["file"])
+    data = pd.to_numeric(df[dfn.indicators["BOND_RATE"]["raw column"]], errors = "coerce")
+    date = pd.to_datetime(df["DATE"])
+    start = time.time()
+    for i in range(repeats):
+        u.mean_year_month(data, date, dfn.start_year, 1, dfn.end_year, 12)
+        u.mean_year_quarter(data, date, dfn.start_year, 1, dfn.end_year, 4)
+    return {"rows" : len(df), "seconds_per_call" : (time.time() - start) / (2 * repeats)}
+
+def _stage_indicators(clear_cache):
+    import cache
+    import indicator_correlation as ind
+    if clear_cache and os.path.isdir(cache.default_cache_dir):
+        cache.clear()
+    return {"indicators" : len(ind.load_indicators())}
+
+def _stage_correlations(n_workers, out_file = None):
+    import indicator_correlation as ind
+    df, failures = ind.get_correlations_sp_500(ind.load_indicators(), 1, n_workers = n_workers)
+    if out_file is not None:
+        df.to_csv(out_file)
+    return {"stocks" : len(df), "failures" : len(failures)}
+
+def _stage_price_store():
+    import price_store as ps
+    return {"stocks" : len(ps.build_store())}
+
+def _stage_sweep(n_workers):
+    import indicator_correlation as ind
+    df, failures = ind.sweep_lags_sp_500(ind.load_indicators(), range(0, 13), n_workers = n_workers)
+    return {"rows" : len(df), "failures" : len(failures)}
+
+def _stage_lead_lag(n_workers):
+    import indicator_correlation as ind
+    lead_lag, failures = ind.get_lead_lag_sp_500(ind.load_indicators(), range(0, 13), n_workers = n_workers)
+    return {"stocks" : len(lead_lag.stocks), "failures" : len(failures)}
+
+def _stage_kmeans(corr_file, n_clusters = 10, method = "full"):
+    import pandas as pd
+    import clustering_analysis as cl
+    import indicator_correlation as ind
+    # Indicators with missing periods have NaN correlations for every stock, so their
+    # columns are dropped before the stocks with missing values.
+    corr_df = pd.read_csv(corr_file, index_col = 0).dropna(axis = 1, how = "all").dropna()
+    corr_df = ind.standardize_correlations(corr_df)
+    cl.run_kmeans(corr_df.select_dtypes(include = ["float64"]), n_clusters, method = method)
+    return {"rows" : len(corr_df)}
+
+# Generate synthetic data and time every stage of the pipeline on it.
+# The correlation window of definitions file is set to the generated years, leaving
+# a year at each end for differences and lags, and restored afterwards.
+# Stages that fail are reported with their error in the results.
+def run_suite(n_tickers, n_years, n_workers = 1, seed = 0, data_dir = None):
+    import definitions as dfn
+    import synthetic
+    keep_data = data_dir is not None
+    if data_dir is None:
+        data_dir = tempfile.mkdtemp(prefix = "stock_benchmark_")
+    cwd = os.getcwd()
+    years = dfn.start_year, dfn.end_year
+    end_year = 2017
+    start_year = end_year - n_years + 2
+    dfn.start_year = start_year
+    dfn.end_year = end_year - 1
+    try:
+        start = time.time()
+        synthetic.generate(data_dir, n_tickers, n_years, end_year, seed)
+        print("Generated %d stocks over %d years in %.1f s" % (n_tickers, n_years, time.time() - start))
+        os.chdir(data_dir)
+        corr_file = os.path.join(data_dir, "correlations.csv")
+        stages = [
+            ("mean_year_month / mean_year_quarter", _stage_mean_year_month),
+            ("get_indicator_data (cold cache)", lambda: _stage_indicators(True)),
+            ("get_indicator_data (warm cache)", lambda: _stage_indicators(False)),
+            ("get_correlations_sp_500 (text files)", lambda: _stage_correlations(n_workers)),
+            ("price_store.build_store", _stage_price_store),
+            ("get_correlations_sp_500 (price store)", lambda: _stage_correlations(n_workers, corr_file)),
+            ("sweep_lags (0-12 months, diff)", lambda: _stage_sweep(n_workers)),
+            ("get_lead_lag (0-12 months)", lambda: _stage_lead_lag(n_workers)),
+            ("run_kmeans", lambda: _stage_kmeans(corr_file)),
+            ("run_kmeans (minibatch)", lambda: _stage_kmeans(corr_file, method = "minibatch")),
+        ]
+        results = [run_stage(name, func) for name, func in stages]
+    finally:
+        os.chdir(cwd)
+        dfn.start_year, dfn.end_year = years
+        if not keep_data:
+            shutil.rmtree(data_dir)
+    return {"timestamp" : time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "config" : {"tickers" : n_tickers, "years" : n_years, "workers" : n_workers, "seed" : seed,
+                    "start_year" : start_year, "end_year" : end_year - 1},
+            "machine" : {"python" : platform.python_version(), "platform" : platform.platform(),
+                    "cpus" : multiprocessing.cpu_count()},
+            "stages" : results}
+
+# Names of the stages that failed.
+def failed_stages(results):
+    return [stage["name"] for stage in results["stages"] if stage["error"]]
+
+# Compare stage times with a previous run. Stages slower by more than threshold
+# (as a fraction of the previous time), and stages that failed, are reported as regressions.
+def compare_results(results, previous, threshold = 0.2):
+    previous_stages = dict((stage["name"], stage) for stage in previous["stages"])
+    regressions = []
+    for stage in results["stages"]:
+        if stage["error"]:
+            print("%-40s FAILED: %s" % (stage["name"], stage["error"]))
+            regressions.append(stage["name"])
+            continue
+        if not previous_stages.has_key(stage["name"]):
+            continue
+        before = previous_stages[stage["name"]]["seconds"]
+        ratio = stage["seconds"] / before if before > 0 else 1.0
+        flag = ratio > 1 + threshold
+        print("%-40s %8.3f s -> %8.3f s  (%5.2fx)%s" % (stage["name"], before, stage["seconds"], ratio,
+                "  REGRESSION" if flag else ""))
+        if flag:
+            regressions.append(stage["name"])
+    return regressions
+
+
+# ********** Full vs. mini-batch Kmeans **********
+
+# Fit Kmeans with a method of run_kmeans on features with known clusters. Quality is the
+# inertia and the adjusted Rand index of the labels against the true clusters.
+def _stage_kmeans_method(method, n_rows, n_features, n_clusters, seed):
+    from sklearn.datasets import make_blobs
+    from sklearn.metrics import adjusted_rand_score
+    import clustering_analysis as cl
+    data, truth = make_blobs(n_rows, n_features, centers = n_clusters, cluster_std = 4.0, random_state = seed)
+    start = time.time()
+    model = cl.run_kmeans(data, n_clusters, method = method)
+    return {"fit_seconds" : time.time() - start, "inertia" : float(model.inertia_),
+            "adjusted_rand" : adjusted_rand_score(truth, model.labels_)}
+
+def compare_kmeans(n_rows, n_features, n_clusters, seed = 0):
+    results = [run_stage("run_kmeans (%s)" % method,
+            lambda: _stage_kmeans_method(method, n_rows, n_features, n_clusters, seed))
+            for method in ["full", "minibatch"]]
+    full = results[0]["info"]
+    print("%-12s %10s %14s %10s %12s" % ("method", "fit s", "inertia", "ratio", "adj. Rand"))
+    for method, result in zip(["full", "minibatch"], results):
+        info = result["info"]
+        if result["error"]:
+            continue
+        print("%-12s %10.3f %14.1f %10.4f %12.4f" % (method, info["fit_seconds"], info["inertia"],
+                info["inertia"] / full["inertia"] if full else np.nan, info["adjusted_rand"]))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Timing runs for the correlation pipeline.")
+    subparsers = parser.add_subparsers(dest = "command")
+    scaling = subparsers.add_parser("scaling", help = "Time a full S&P run for several worker counts.")
+    scaling.add_argument("--workers", type = int, nargs = "+",
+            default = sorted(set([1, 2, 4, multiprocessing.cpu_count()])))
+    scaling.add_argument("--lag", type = int, default = 1)
+    scaling.add_argument("--diff", action = "store_true")
+    regression = subparsers.add_parser("regression",
+            help = "Check batched correlations against per-pair np.corrcoef.")
+    regression.add_argument("--stocks", type = int, default = 50, help = "Number of S&P stocks to check.")
+    regression.add_argument("--lag", type = int, default = 1)
+    regression.add_argument("--diff", action = "store_true")
+    startup = subparsers.add_parser("startup", help = "Time module imports in a fresh interpreter.")
+    startup.add_argument("--repeats", type = int, default = 5)
+    suite = subparsers.add_parser("suite", help = "Time every pipeline stage on synthetic data.")
+    suite.add_argument("--tickers", type = int, default = 500)
+    suite.add_argument("--years", type = int, default = 10)
+    suite.add_argument("--workers", type = int, default = 1)
+    suite.add_argument("--seed", type = int, default = 0)
+    suite.add_argument("--data-dir", help = "Keep the generated data in this folder.")
+    suite.add_argument("--out", help = "Write results to this JSON file.")
+    suite.add_argument("--compare", help = "JSON results of a previous run to compare with.")
+    suite.add_argument("--threshold", type = float, default = 0.2,
+            help = "Slowdown (as a fraction) reported as a regression.")
+    kmeans = subparsers.add_parser("kmeans", help = "Compare full and mini-batch Kmeans on synthetic features.")
+    kmeans.add_argument("--rows", type = int, default = 50000)
+    kmeans.add_argument("--features", type = int, default = 100)
+    kmeans.add_argument("--clusters", type = int, default = 10)
+    kmeans.add_argument("--seed", type = int, default = 0)
+    args = parser.parse_args()
+    instrument.log_to_stderr(logging.WARNING)
+
+    if args.command == "scaling":
+        run_scaling(args.workers, args.lag, args.diff)
+    elif args.command == "regression":
+        import indicator_correlation as ind
+        if not check_correlation_kernel(ind.get_sp_500_stocks()[:args.stocks], args.lag, args.diff):
+            sys.exit(1)
+    elif args.command == "startup":
+        run_startup(args.repeats)
+    elif args.command == "suite":
+        results = run_suite(args.tickers, args.years, args.workers, args.seed, args.data_dir)
+        if args.out:
+            with open(args.out, "w") as f:
+                json.dump(results, f, indent = 2, sort_keys = True)
+        if args.compare:
+            with open(args.compare) as f:
+                if compare_results(results, json.load(f), args.threshold):
+                    sys.exit(1)
+        elif failed_stages(results):
+            print("Failed stages: %s" % ", ".join(failed_stages(results)))
+            sys.exit(1)
+    elif args.command == "kmeans":
+        compare_kmeans(args.rows, args.features, args.clusters, args.seed)
+    else:
+        parser.print_help()
+
+if __name__ == "__main__":
+    main()
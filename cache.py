@@ -0,0 +1,76 @@
+# On-disk cache of arrays computed from data files.
+# Entries are keyed by a hash of everything they were computed from, including
+# the contents of the source file, so a changed file or setting simply maps to a
+# new entry. The least recently used entries are removed once the cache grows
+# beyond its size limit.
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+default_cache_dir = "data/cache"
+default_max_bytes = 100 * 1024 * 1024
+
+# Hashes of files already read in this process, by (path, size, mtime).
+_file_hashes = {}
+
+# SHA-1 of the contents of a file.
+def file_hash(path):
+    stat = os.stat(path)
+    key = (path, stat.st_size, stat.st_mtime)
+    if not _file_hashes.has_key(key):
+        sha = hashlib.sha1()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                sha.update(block)
+        _file_hashes[key] = sha.hexdigest()
+    return _file_hashes[key]
+
+# Cache key for a list of JSON-serializable parts.
+def cache_key(parts):
+    return hashlib.sha1(json.dumps(parts, sort_keys = True).encode("utf-8")).hexdigest()
+
+# Return the cached array for key_parts, or compute it with compute() and cache it.
+def cached_array(key_parts, compute, cache_dir = default_cache_dir, max_bytes = default_max_bytes):
+    path = os.path.join(cache_dir, cache_key(key_parts) + ".npy")
+    if os.path.exists(path):
+        try:
+            value = np.load(path)
+            # Mark the entry as recently used.
+            os.utime(path, None)
+            return value
+        except (IOError, ValueError):
+            # Unreadable entry (e.g. a partly written file), compute it again.
+            pass
+    value = np.asarray(compute())
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    tmp_path = "%s.%d.tmp.npy" % (path[:-len(".npy")], os.getpid())
+    np.save(tmp_path, value)
+    os.rename(tmp_path, path)
+    evict(cache_dir, max_bytes)
+    return value
+
+# Remove the least recently used entries until the cache is at most max_bytes.
+def evict(cache_dir = default_cache_dir, max_bytes = default_max_bytes):
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.endswith(".npy") and not name.endswith(".tmp.npy"):
+            stat = os.stat(os.path.join(cache_dir, name))
+            entries.append((stat.st_mtime, stat.st_size, name))
+    total = sum(e[1] for e in entries)
+    for mtime, size, name in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(os.path.join(cache_dir, name))
+        except OSError:
+            # Already removed by another process.
+            pass
+        total = total - size
+
+# Remove all entries.
+def clear(cache_dir = default_cache_dir):
+    evict(cache_dir, 0)
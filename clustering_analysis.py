@@ -1,20 +1,156 @@
+from collections import namedtuple
+
 import numpy as np
-import matplotlib.pyplot as plt
-from sklearn.cluster import KMeans
 
-def run_kmeans(df, n_clusters):
+# Fit Kmeans on the rows of df. With method = "minibatch", the model is fitted with
+# StreamingKMeans on float32 chunks of batch_size rows, which is much faster for large
+# feature sets. Both return a model with cluster_centers_, labels_ and inertia_.
+def run_kmeans(df, n_clusters, method = "full", batch_size = 1024, n_epochs = 10):
+    if method == "minibatch":
+        return StreamingKMeans(n_clusters, batch_size).fit(df, n_epochs).model
+    from sklearn.cluster import KMeans
     estimator = KMeans(n_clusters = n_clusters, random_state = 0)
     return estimator.fit(df)
 
+# ********** Mini-batch Kmeans for large feature sets **********
+
+def _as_float32(data):
+    return np.ascontiguousarray(np.asarray(data, dtype = np.float32))
+
+# Consecutive chunks of chunk_rows rows of an array or dataframe.
+def iter_chunks(data, chunk_rows):
+    for i in range(0, len(data), chunk_rows):
+        yield data[i:i + chunk_rows]
+
+class StreamingKMeans(object):
+    # Kmeans fitted with MiniBatchKMeans.partial_fit on chunks of rows, so that the
+    # features never need to be in memory at once, e.g. when read chunk by chunk from
+    # a results folder. Chunks are converted to float32, and each is one mini batch.
+    # New stocks are assigned to the fitted clusters with predict, without refitting.
+
+    def __init__(self, n_clusters, batch_size = 1024, random_state = 0):
+        from sklearn.cluster import MiniBatchKMeans
+        self.batch_size = batch_size
+        self.random_state = random_state
+        self.model = MiniBatchKMeans(n_clusters = n_clusters, batch_size = batch_size, \
+                random_state = random_state, compute_labels = False)
+
+    @property
+    def cluster_centers_(self):
+        return self.model.cluster_centers_
+
+    # Update the clusters with a chunk of rows.
+    def partial_fit(self, chunk):
+        self.model.partial_fit(_as_float32(chunk))
+        return self
+
+    # Update the clusters with every chunk of an iterable of chunks, in one pass.
+    def fit_chunks(self, chunks):
+        for chunk in chunks:
+            self.partial_fit(chunk)
+        return self
+
+    # Fit on data held in memory, in n_epochs passes over the rows in random order.
+    # Labels and inertia of all rows are set on the model afterwards, as KMeans does.
+    def fit(self, data, n_epochs = 10):
+        data = _as_float32(data)
+        rng = np.random.RandomState(self.random_state)
+        for epoch in range(n_epochs):
+            self.fit_chunks(iter_chunks(data[rng.permutation(len(data))], self.batch_size))
+        self.model.labels_, self.model.inertia_ = self.assign(data)
+        return self
+
+    # Nearest cluster of each row, and the sum of squared distances to it.
+    def assign(self, data, chunk_rows = 100000):
+        labels = []
+        inertia = 0.0
+        centers = self.model.cluster_centers_.astype(np.float64)
+        for chunk in iter_chunks(_as_float32(data), chunk_rows):
+            distances = centroid_distances(chunk.astype(np.float64), centers)
+            chunk_labels = distances.argmin(axis = 1)
+            labels.append(chunk_labels)
+            inertia += (distances[np.arange(len(chunk)), chunk_labels] ** 2).sum()
+        return np.concatenate(labels) if labels else np.zeros(0, dtype = np.int64), inertia
+
+    # Cluster of each row of data, e.g. for stocks added after fitting.
+    def predict(self, data, chunk_rows = 100000):
+        return self.assign(data, chunk_rows)[0]
+
+# ********** Choosing the number of clusters **********
+
+# Results of fitting Kmeans for a range of cluster numbers, one entry per number:
+# - models: fitted KMeans models.
+# - inertia: sum of squared distances from the cluster centroids.
+# - mean_distance: mean distance from the cluster centroid (as in the elbow curve).
+# - silhouette: mean simplified silhouette, using distances to centroids
+#   instead of all pairs of points.
+ClusterSearch = namedtuple("ClusterSearch", ["n_clusters", "models", "inertia", "mean_distance", "silhouette"])
+
+def _fit_kmeans(n_clusters, data, method = "full"):
+    return run_kmeans(data, n_clusters, method)
+
+# Distances of every row of data from every centroid, without an all-pairs matrix.
+def centroid_distances(data, centers):
+    sq = (data * data).sum(axis = 1)[:, np.newaxis] - 2 * np.dot(data, centers.T) + \
+            (centers * centers).sum(axis = 1)[np.newaxis, :]
+    return np.sqrt(np.maximum(sq, 0))
+
+# Fit Kmeans for every number of clusters from min_n_clusters to max_n_clusters.
+# - n_workers: fit the cluster numbers in parallel on this many processes
+#   (defaults to the number of cores).
+# - warm_start: fit the cluster numbers in order instead, each starting from the
+#   centroids of the previous one plus the point farthest from its centroid.
+# - method: "full" or "minibatch", as in run_kmeans (warm_start uses full Kmeans).
+def search_n_clusters(df, max_n_clusters = 10, min_n_clusters = 2, n_workers = None, warm_start = False, \
+        method = "full"):
+    from sklearn.cluster import KMeans
+    import utils as u
+    data = np.asarray(df, dtype = np.float64)
+    n_clusters = range(min_n_clusters, max_n_clusters + 1)
+
+    if warm_start:
+        models = [run_kmeans(data, n_clusters[0])]
+        for k in n_clusters[1:]:
+            prev = models[-1]
+            distances = centroid_distances(data, prev.cluster_centers_)
+            farthest = np.argmax(distances[np.arange(len(data)), prev.labels_])
+            init = np.vstack([prev.cluster_centers_, data[farthest]])
+            models.append(KMeans(n_clusters = k, init = init, n_init = 1, random_state = 0).fit(data))
+    else:
+        models, failures = u.run_batch(_fit_kmeans, n_clusters, (data, method), n_workers, chunksize = 1, \
+                label = "cluster numbers", item = "Kmeans with %s clusters")
+        if len(failures) > 0:
+            raise ValueError("Kmeans failed for %s clusters: %s" % (failures[0]["Name"], failures[0]["reason"]))
+
+    mean_distance = []
+    silhouette = []
+    for model in models:
+        # Assignments of the fitted model: its own centroid is the nearest one.
+        distances = centroid_distances(data, model.cluster_centers_)
+        own = distances[np.arange(len(data)), model.labels_]
+        distances[np.arange(len(data)), model.labels_] = np.inf
+        other = distances.min(axis = 1)
+        mean_distance.append(own.mean())
+        with np.errstate(invalid = "ignore", divide = "ignore"):
+            silhouette.append(np.nan_to_num((other - own) / np.maximum(own, other)).mean())
+    return ClusterSearch(list(n_clusters), models, [m.inertia_ for m in models], mean_distance, silhouette)
+
+# Plot a measure from search_n_clusters (mean_distance, inertia or silhouette)
+# as a function of the number of clusters.
+def plot_cluster_search(results, measure = "mean_distance", axes_object = ""):
+    import matplotlib.pyplot as plt
+    labels = {"mean_distance" : "Mean distance from centroid", "inertia" : "Inertia",
+            "silhouette" : "Mean silhouette"}
+    if axes_object == "":
+        fig, ax = plt.subplots(1, 1)
+    else:
+        ax = axes_object
+    ax.plot(results.n_clusters, getattr(results, measure))
+    ax.set_xlabel("# Clusters")
+    ax.set_ylabel(labels[measure])
+    return ax
+
 def plot_elbow_curve(df, max_n_clusters = 10):
     # Create a plot of mean distance from cluster centroid as a function of
     # number of Kmeans clusters.
-    from scipy.spatial.distance import cdist
-    
-    distortions = []
-    for k in range(2, max_n_clusters + 1):
-        km = run_kmeans(df, k)
-        distortions.append(np.mean(np.min(cdist(df, km.cluster_centers_, 'euclidean'), axis=1)))
-    plt.plot(range(2, max_n_clusters + 1), distortions)
-    plt.xlabel("# Clusters")
-    plt.ylabel("Mean distance from centroid")
+    return plot_cluster_search(search_n_clusters(df, max_n_clusters))
@@ -0,0 +1,193 @@
+# Batched Pearson correlations between the rows of two matrices.
+# Stocks and indicators are given as (series x periods) arrays, and all pairwise
+# correlations are computed with one matrix multiply instead of one np.corrcoef
+# call per pair.
+
+import numpy as np
+
+from aligned import AlignedIndicators, indicator_period
+
+
+# ********** Correlation kernels **********
+
+# Center each row and scale it to unit norm, so that the dot product of two
+# rows is their correlation. Constant rows become NaN.
+def normalize_rows(x):
+    x = np.asarray(x, dtype = np.float64)
+    x = x - x.mean(axis = 1)[:, np.newaxis]
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        return x / np.sqrt((x * x).sum(axis = 1))[:, np.newaxis]
+
+# Subtract the mean of each row (along the last axis), ignoring NaN. Centering does
+# not change correlations, and keeps the sums of squares computed from the rows well
+# conditioned.
+def center_rows(x):
+    with np.errstate(invalid = "ignore"):
+        return x - np.nanmean(x, axis = -1)[..., np.newaxis]
+
+# Correlations from the sums over n periods of x, y, x^2, y^2 and xy, given as arrays
+# that broadcast together. Pairs where either series is constant get NaN.
+def corr_from_sums(n, sum_x, sum_y, sum_xx, sum_yy, sum_xy):
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        return (n * sum_xy - sum_x * sum_y) / \
+                np.sqrt((n * sum_xx - sum_x * sum_x) * (n * sum_yy - sum_y * sum_y))
+
+# Correlation of every row of x (a x periods) with every row of y (b x periods).
+# Returns an (a x b) matrix. Pairs where either row has a missing (NaN) period get
+# NaN, as with np.corrcoef; see masked_corr_matrix for pairwise complete periods.
+def corr_matrix(x, y):
+    x = np.atleast_2d(x)
+    y = np.atleast_2d(y)
+    if x.shape[1] != y.shape[1]:
+        raise ValueError("Expecting the same number of periods, got %s and %s." % (x.shape[1], y.shape[1]))
+    return np.dot(normalize_rows(x), normalize_rows(y).T)
+
+# Same as corr_matrix, for rows with missing (NaN) periods. Each pair of rows is
+# correlated over the periods where both have data, and pairs with fewer than
+# min_periods such periods get NaN.
+def masked_corr_matrix(x, y, min_periods = 3):
+    x = np.atleast_2d(np.asarray(x, dtype = np.float64))
+    y = np.atleast_2d(np.asarray(y, dtype = np.float64))
+    if x.shape[1] != y.shape[1]:
+        raise ValueError("Expecting the same number of periods, got %s and %s." % (x.shape[1], y.shape[1]))
+    mask_x = (~np.isnan(x)).astype(np.float64)
+    mask_y = (~np.isnan(y)).astype(np.float64)
+    x = np.where(mask_x > 0, center_rows(x), 0)
+    y = np.where(mask_y > 0, center_rows(y), 0)
+
+    # Sums over the periods shared by each pair of rows.
+    n = np.dot(mask_x, mask_y.T)
+    sum_x = np.dot(x, mask_y.T)
+    sum_y = np.dot(mask_x, y.T)
+    sum_xx = np.dot(x * x, mask_y.T)
+    sum_yy = np.dot(mask_x, (y * y).T)
+    r = corr_from_sums(n, sum_x, sum_y, sum_xx, sum_yy, np.dot(x, y.T))
+    r[n < min_periods] = np.nan
+    return r
+
+
+# ********** Stocks vs. indicators **********
+
+# Matrices of monthly and quarterly indicator data, one row per indicator in
+# the order of the indicators argument. Aligned indicator data (see aligned.py)
+# already holds these matrices.
+def indicator_matrix(indicator_data, indicators, period):
+    if isinstance(indicator_data, AlignedIndicators):
+        return indicator_data.matrix(period, [ind for ind in indicators if indicator_period(ind) == period])
+    rows = [indicator_data[ind] for ind in indicators if indicator_period(ind) == period]
+    return np.array(rows, dtype = np.float64)
+
+# Correlation of every stock with every indicator.
+# - monthly: (stocks x months) matrix of stock data, aligned with the monthly indicators.
+# - quarterly: (stocks x quarters) matrix, aligned with the quarterly indicators.
+# - indicator_data: dictionary with indicator data, as in indicator_correlation.
+# Returns a (stocks x indicators) matrix, with indicators in sorted order, and the
+# list of indicators. Pairs where the stock or the indicator has a missing period
+# get NaN, like the lagged, rolling and lead-lag correlations.
+def corr_with_indicators(monthly, quarterly, indicator_data):
+    indicators = sorted(indicator_data.keys())
+    r = np.empty((np.atleast_2d(monthly).shape[0], len(indicators)))
+    for period, stock_data in [("month", monthly), ("quarter", quarterly)]:
+        columns = [i for i, ind in enumerate(indicators) if indicator_period(ind) == period]
+        if len(columns) == 0:
+            continue
+        stock_data = np.atleast_2d(np.asarray(stock_data, dtype = np.float64))
+        r[:, columns] = corr_matrix(stock_data, indicator_matrix(indicator_data, indicators, period))
+    return r, indicators
+
+
+# ********** Rolling correlations **********
+
+# Correlation of every row of x (a x periods) with every row of y (b x periods) over
+# windows of `window` consecutive periods, for every window end, using prefix sums
+# so that each window costs O(1) regardless of its length.
+# If window is None, windows are expanding from the first period, starting with
+# min_periods periods. Windows that contain NaN get NaN.
+# Returns an (a x b x windows) array and the index of the last period of each window.
+def rolling_corr_matrix(x, y, window = None, min_periods = 3, max_bytes = 256 * 1024 * 1024):
+    x = np.atleast_2d(np.asarray(x, dtype = np.float64))
+    y = np.atleast_2d(np.asarray(y, dtype = np.float64))
+    if x.shape[1] != y.shape[1]:
+        raise ValueError("Expecting the same number of periods, got %s and %s." % (x.shape[1], y.shape[1]))
+    n_periods = x.shape[1]
+    if window is None:
+        stops = np.arange(min_periods, n_periods + 1)
+        starts = np.zeros(len(stops), dtype = np.int64)
+    else:
+        stops = np.arange(window, n_periods + 1)
+        starts = stops - window
+    n = (stops - starts).astype(np.float64)
+
+    def prefix_sums(data):
+        data = center_rows(data)
+        zeros = np.zeros(data.shape[:-1] + (1,))
+        missing = np.concatenate([zeros, np.cumsum(np.isnan(data), axis = -1)], axis = -1)
+        data = np.where(np.isnan(data), 0.0, data)
+        sums = np.concatenate([zeros, np.cumsum(data, axis = -1)], axis = -1)
+        squares = np.concatenate([zeros, np.cumsum(data * data, axis = -1)], axis = -1)
+        return data, missing, sums, squares
+
+    def window_sums(cum):
+        return cum[..., stops] - cum[..., starts]
+
+    x, missing_x, sum_x, sum_xx = prefix_sums(x)
+    y, missing_y, sum_y, sum_yy = prefix_sums(y)
+    sum_x, sum_xx, missing_x = window_sums(sum_x), window_sums(sum_xx), window_sums(missing_x)
+    sum_y, sum_yy, missing_y = window_sums(sum_y), window_sums(sum_yy), window_sums(missing_y)
+
+    # Cross products take (rows of x) x (rows of y) x periods memory, so rows of x
+    # are processed in chunks of at most max_bytes.
+    r = np.empty((x.shape[0], y.shape[0], len(stops)))
+    chunk = max(1, int(max_bytes // (8 * y.shape[0] * (n_periods + 1))))
+    zeros = np.zeros((1, y.shape[0], 1))
+    for i in range(0, x.shape[0], chunk):
+        xy = x[i:i + chunk, np.newaxis, :] * y[np.newaxis, :, :]
+        sum_xy = window_sums(np.concatenate([np.repeat(zeros, xy.shape[0], axis = 0), \
+                np.cumsum(xy, axis = -1)], axis = -1))
+        r[i:i + chunk] = corr_from_sums(n, sum_x[i:i + chunk, np.newaxis, :], sum_y[np.newaxis, :, :], \
+                sum_xx[i:i + chunk, np.newaxis, :], sum_yy[np.newaxis, :, :], sum_xy)
+    missing = (missing_x[:, np.newaxis, :] + missing_y[np.newaxis, :, :]) > 0
+    r[missing] = np.nan
+    return r, stops - 1
+
+# Correlation of every row of y (b x n periods) with each window of n consecutive periods
+# of every row of x (a x (n + shifts - 1) periods), i.e. with x shifted by 0 to shifts - 1
+# periods. Sums of products for all shifts come from one FFT per row, and the window
+# sums of x from prefix sums. Windows of x with NaN, and rows of y with NaN, get NaN.
+# Returns an (a x b x shifts) array.
+def shifted_corr_matrix(x, y, max_bytes = 256 * 1024 * 1024):
+    x = np.atleast_2d(np.asarray(x, dtype = np.float64))
+    y = np.atleast_2d(np.asarray(y, dtype = np.float64))
+    n = y.shape[1]
+    n_shifts = x.shape[1] - n + 1
+    if n_shifts < 1:
+        raise ValueError("Expecting at least %d periods of x, got %d." % (n, x.shape[1]))
+
+    # With centered rows of y, the covariance is the sum of products, whatever the
+    # mean of the window of x.
+    y = center_rows(y)
+    x = center_rows(x)
+    missing_y = np.isnan(y).any(axis = 1)
+    y = np.where(np.isnan(y), 0.0, y)
+    zeros = np.zeros((x.shape[0], 1))
+    missing_x = np.concatenate([zeros, np.cumsum(np.isnan(x), axis = 1)], axis = 1)
+    x = np.where(np.isnan(x), 0.0, x)
+    sum_x = np.concatenate([zeros, np.cumsum(x, axis = 1)], axis = 1)
+    sum_xx = np.concatenate([zeros, np.cumsum(x * x, axis = 1)], axis = 1)
+    missing_x = (missing_x[:, n:] - missing_x[:, :n_shifts]) > 0
+    sum_x = sum_x[:, n:] - sum_x[:, :n_shifts]
+    var_x = sum_xx[:, n:] - sum_xx[:, :n_shifts] - sum_x * sum_x / n
+    var_y = (y * y).sum(axis = 1)
+
+    # Circular cross-correlation over a length that fits x, so shifts do not wrap around.
+    size = 1 << int(np.ceil(np.log2(x.shape[1])))
+    fft_x = np.fft.rfft(x, size)
+    fft_y = np.conj(np.fft.rfft(y, size))
+    r = np.empty((x.shape[0], y.shape[0], n_shifts))
+    chunk = max(1, int(max_bytes // (8 * y.shape[0] * (2 * fft_x.shape[1] + size))))
+    for i in range(0, x.shape[0], chunk):
+        sum_xy = np.fft.irfft(fft_x[i:i + chunk, np.newaxis, :] * fft_y[np.newaxis, :, :], size)[:, :, :n_shifts]
+        with np.errstate(invalid = "ignore", divide = "ignore"):
+            r[i:i + chunk] = sum_xy / np.sqrt(var_x[i:i + chunk, np.newaxis, :] * var_y[np.newaxis, :, np.newaxis])
+    r[missing_x[:, np.newaxis, :] | missing_y[np.newaxis, :, np.newaxis]] = np.nan
+    return r
@@ -0,0 +1,202 @@
+# Incremental correlations for streams of new daily prices.
+# Keeps running sums and counts of the prices in each month and quarter, and running
+# co-moments of each stock with each indicator for every lag, so that new rows only
+# update the periods they fall in and the correlations that use those periods.
+# Results are the same as sweep_lags in indicator_correlation on the full data:
+#   inc = IncrementalCorrelations(indicator_data, lags = range(0, 25))
+#   inc.update_from_file("amzn")   # reads the whole file the first time
+#   ...                            # rows are appended to data/stocks/amzn.us.txt
+#   inc.update_from_file("amzn")   # only reads the new rows
+#   df = inc.correlations()
+
+import numpy as np
+
+import definitions as dfn
+import utils as u
+from aligned import as_aligned
+from correlation import center_rows, corr_from_sums, indicator_matrix, indicator_period
+from indicator_correlation import lagged_windows
+
+
+# ********** Running sums for one stock and one time resolution **********
+
+class PeriodCorrelations(object):
+    # Running means of a stock in each period, and for every (lag, diff) window and
+    # indicator the sums n, x, y, x^2, y^2 and xy over the window positions where the
+    # stock has data. Missing periods give NaN as in corr_matrix: indicators with any
+    # missing period, and windows the stock does not fully cover. Indicators are
+    # centered, and stock prices shifted by a constant, which leaves correlations
+    # unchanged but keeps the sums well conditioned.
+
+    def __init__(self, period, indicator_rows, keys, windows):
+        self.period = period
+        self.keys = keys
+        self.starts = np.array([windows[k][0] for k in keys])
+        self.diffs = np.array([bool(k[1]) for k in keys])
+        y = np.atleast_2d(np.asarray(indicator_rows, dtype = np.float64))
+        self.missing_y = np.isnan(y).any(axis = 1)
+        y = center_rows(y)
+        self.y = np.where(np.isnan(y), 0.0, y)
+        self.n_positions = y.shape[1]
+        shape = (len(keys), y.shape[0])
+        self.n = np.zeros(shape)
+        self.sum_x = np.zeros(shape)
+        self.sum_y = np.zeros(shape)
+        self.sum_xx = np.zeros(shape)
+        self.sum_yy = np.zeros(shape)
+        self.sum_xy = np.zeros(shape)
+        # Number of window positions with stock data, for each (lag, diff).
+        self.filled = np.zeros(len(keys), dtype = np.int64)
+        self.sums = {}
+        self.counts = {}
+
+    def mean(self, p):
+        if self.counts.get(p, 0) == 0:
+            return np.nan
+        return self.sums[p] / self.counts[p]
+
+    # Stock value at window position t for (lag, diff) number k, with means looked up by mean(p).
+    def _x(self, k, t, mean):
+        start = self.starts[k]
+        if self.diffs[k]:
+            return mean(start + t + 1) - mean(start + t)
+        return mean(start + t)
+
+    def _accumulate(self, k, t, x, sign):
+        if np.isnan(x):
+            return
+        y = self.y[:, t]
+        self.n[k] += sign
+        self.sum_x[k] += sign * x
+        self.sum_y[k] += sign * y
+        self.sum_xx[k] += sign * x * x
+        self.sum_yy[k] += sign * y * y
+        self.sum_xy[k] += sign * x * y
+        self.filled[k] += int(sign)
+
+    # Add new (already shifted) prices, given with the period index of each.
+    def add(self, index, values):
+        valid = ~np.isnan(values)
+        changed, inverse = np.unique(index[valid], return_inverse = True)
+        if len(changed) == 0:
+            return
+        sums = np.bincount(inverse, weights = values[valid])
+        counts = np.bincount(inverse)
+        old_means = dict((p, self.mean(p)) for p in changed)
+        for p, s, c in zip(changed, sums, counts):
+            self.sums[p] = self.sums.get(p, 0.0) + s
+            self.counts[p] = self.counts.get(p, 0) + c
+
+        # Window positions whose stock value depends on a changed period.
+        positions = set()
+        for k in range(len(self.keys)):
+            for p in changed:
+                t = p - self.starts[k]
+                if self.diffs[k]:
+                    candidates = [t - 1, t]
+                else:
+                    candidates = [t]
+                for c in candidates:
+                    if 0 <= c < self.n_positions:
+                        positions.add((k, c))
+        old_mean = lambda p: old_means[p] if old_means.has_key(p) else self.mean(p)
+        for k, t in positions:
+            self._accumulate(k, t, self._x(k, t, old_mean), -1.0)
+            self._accumulate(k, t, self._x(k, t, self.mean), 1.0)
+
+    # Correlations for each (lag, diff) and indicator. Windows the stock does not
+    # fully cover, and indicators with missing periods, get NaN, as in sweep_lags.
+    def correlations(self):
+        r = corr_from_sums(self.n, self.sum_x, self.sum_y, self.sum_xx, self.sum_yy, self.sum_xy)
+        r[self.filled < self.n_positions] = np.nan
+        r[:, self.missing_y] = np.nan
+        return r
+
+
+# ********** Running correlations for many stocks **********
+
+class IncrementalCorrelations(object):
+
+    def __init__(self, indicator_data, lags = range(0, 25), diffs = (False, True)):
+        self.indicator_data = as_aligned(indicator_data)
+        self.indicators = sorted(self.indicator_data.keys())
+        self.keys = [(lag, bool(diff)) for diff in diffs for lag in lags]
+        self.lags = list(lags)
+        self.diffs = [bool(d) for d in diffs]
+        self.stocks = {}
+        # Byte offset up to which each stock file has been read, and its header.
+        self.file_offsets = {}
+
+    def _new_stock(self):
+        stock = {"shift" : None}
+        for period in ["month", "quarter"]:
+            if any(indicator_period(ind) == period for ind in self.indicators):
+                windows = lagged_windows(period, self.lags, self.diffs)
+                stock[period] = PeriodCorrelations(period, \
+                        indicator_matrix(self.indicator_data, self.indicators, period), self.keys, windows)
+        return stock
+
+    # Add new daily rows for a stock. Rows are assumed not to repeat dates already added.
+    def add_rows(self, stock_file, dates, closes):
+        if not self.stocks.has_key(stock_file):
+            self.stocks[stock_file] = self._new_stock()
+        stock = self.stocks[stock_file]
+        closes = np.asarray(closes, dtype = np.float64)
+        if stock["shift"] is None:
+            valid = closes[~np.isnan(closes)]
+            if len(valid) == 0:
+                return
+            stock["shift"] = valid[0]
+        dates = np.asarray(dates).astype("datetime64[D]")
+        for period in ["month", "quarter"]:
+            if stock.has_key(period):
+                stock[period].add(u.period_index(dates, period), closes - stock["shift"])
+
+    # Read the rows added to a stock file since the last call (the whole file the
+    # first time). A last line without a newline is left for the next call.
+    def update_from_file(self, stock_file, path = None):
+        if path is None:
+            path = "data/stocks/" + stock_file + ".us.txt"
+        offset, header = self.file_offsets.get(stock_file, (0, None))
+        with open(path, "rb") as f:
+            f.seek(offset)
+            text = f.read()
+        end = text.rfind(b"\n") + 1
+        lines = text[:end].decode("utf-8").splitlines()
+        if header is None and len(lines) > 0:
+            header = lines[0].strip().split(",")
+            lines = lines[1:]
+        self.file_offsets[stock_file] = (offset + end, header)
+        if len(lines) == 0:
+            return 0
+
+        date_col = header.index("Date")
+        close_col = header.index("Close")
+        fields = [line.split(",") for line in lines if line.strip()]
+        dates = np.array([f[date_col] for f in fields], dtype = "datetime64[D]")
+        self.add_rows(stock_file, dates, [_to_float(f[close_col]) for f in fields])
+        return len(fields)
+
+    # Correlations of every stock with every indicator, in the long format of sweep_lags.
+    def correlations(self):
+        import pandas as pd
+        rows = []
+        for stock_file in sorted(self.stocks.keys()):
+            stock = self.stocks[stock_file]
+            for period in ["month", "quarter"]:
+                if not stock.has_key(period):
+                    continue
+                r = stock[period].correlations()
+                period_indicators = [ind for ind in self.indicators if indicator_period(ind) == period]
+                for k, (lag, diff) in enumerate(self.keys):
+                    for i, indicator in enumerate(period_indicators):
+                        rows.append({"Name" : stock_file, "indicator" : dfn.indicators[indicator]["df column"], \
+                                "lag" : lag, "diff" : diff, "r" : r[k, i]})
+        df = pd.DataFrame(rows, columns = ["Name", "indicator", "lag", "diff", "r"])
+        return df.sort_values(["Name", "diff", "lag", "indicator"]).reset_index(drop = True)
+
+def _to_float(text):
+    try:
+        return float(text)
+    except ValueError:
+        return np.nan
@@ -1,60 +1,124 @@
-import pandas as pd
+from collections import namedtuple
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
 import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
 
+import cache
+import instrument
+from aligned import align_indicators, as_aligned, lag_window, period_range
 import utils as u
 import definitions as dfn
+from correlation import corr_matrix, corr_with_indicators, indicator_matrix, indicator_period, \
+        rolling_corr_matrix, shifted_corr_matrix
 
 
 # ********** Prepare monthly or quarterly indicator data **********
 
-def get_indicator_data(indicator_dict):
+# Monthly or quarterly indicator data for the range specified in definitions file,
+# or for the years [start_year, end_year] if given. With allow_missing, periods
+# without data are NaN instead of raising a ValueError.
+# Results are kept in the on-disk cache (see cache.py), keyed by the contents of the
+# indicator file and every setting they depend on.
+def get_indicator_data(indicator_dict, start_year = None, end_year = None, allow_missing = False):
+    start_year = dfn.start_year if start_year is None else start_year
+    end_year = dfn.end_year if end_year is None else end_year
+    path = "data/indicators/%s" % indicator_dict["file"]
+    key = ["indicator", cache.file_hash(path), indicator_dict["raw column"], indicator_dict["time"], \
+            indicator_dict.get("diff", False) == True, start_year, end_year, allow_missing]
+    return cache.cached_array(key, \
+            lambda: read_indicator_data(indicator_dict, start_year, end_year, allow_missing)).tolist()
+
+def read_indicator_data(indicator_dict, start_year = None, end_year = None, allow_missing = False):
+    import pandas as pd
+    start_year = dfn.start_year if start_year is None else start_year
+    end_year = dfn.end_year if end_year is None else end_year
     df = pd.read_csv("data/indicators/%s" % indicator_dict["file"])
     data = pd.to_numeric(df[indicator_dict["raw column"]], errors = "coerce")
     date = pd.to_datetime(df["DATE"])
     if indicator_dict["time"] == "quarter":
         if indicator_dict.has_key("diff") and indicator_dict["diff"] == True:
-            return np.diff(u.mean_year_quarter(data, date, dfn.start_year - 1, 4, dfn.end_year, 4)).tolist()
+            return np.diff(u.mean_by_period(data, date, "quarter", start_year - 1, 4, end_year, 4, \
+                    allow_missing)).tolist()
         else:
-            return u.mean_year_quarter(data, date, dfn.start_year, 1, dfn.end_year, 4)
+            return u.mean_by_period(data, date, "quarter", start_year, 1, end_year, 4, allow_missing).tolist()
     else:
         if indicator_dict.has_key("diff") and indicator_dict["diff"] == True:
-            return np.diff(u.mean_year_month(data, date, dfn.start_year - 1, 12, dfn.end_year, 12)).tolist()
+            return np.diff(u.mean_by_period(data, date, "month", start_year - 1, 12, end_year, 12, \
+                    allow_missing)).tolist()
         else:
-            return u.mean_year_month(data, date, dfn.start_year, 1, dfn.end_year, 12)
-    
+            return u.mean_by_period(data, date, "month", start_year, 1, end_year, 12, allow_missing).tolist()
+
+# Load the data of all indicators in definitions file into a dictionary.
+def load_indicators():
+    indicator_data = {}
+    for indicator in dfn.indicators.keys():
+        indicator_data[indicator] = get_indicator_data(dfn.indicators[indicator])
+    return indicator_data
+
+# Dictionary-like access to the data of all indicators, where each indicator
+# is only loaded the first time it is used.
+class IndicatorData(Mapping):
+    def __init__(self, indicators):
+        self._indicators = indicators
+        self._data = {}
+
+    def __getitem__(self, indicator):
+        # Data depends on the range in definitions file, which may change between calls.
+        key = (indicator, dfn.start_year, dfn.end_year)
+        if not self._data.has_key(key):
+            self._data[key] = get_indicator_data(self._indicators[indicator])
+        return self._data[key]
+
+    def __iter__(self):
+        return iter(self._indicators)
+
+    def __len__(self):
+        return len(self._indicators)
+
+    # All indicators as AlignedIndicators (see aligned.py), built once for the range in definitions file.
+    def aligned(self):
+        key = ("aligned", dfn.start_year, dfn.end_year)
+        if not self._data.has_key(key):
+            self._data[key] = as_aligned(dict((ind, self[ind]) for ind in self._indicators))
+        return self._data[key]
+
 # ********** Plotting helpers **********
 
 def plot_indicators(indicators_data_dict):
-    indicator_names = indicators_data_dict.keys()
+    import matplotlib.pyplot as plt
+    aligned = as_aligned(indicators_data_dict)
+    indicator_names = aligned.indicators
     n_indicators = len(indicator_names)
-    fig = plt.figure()
+    fig, axes = plt.subplots(n_indicators, 1, squeeze = False)
     fig.set_size_inches(6, 1.5 * n_indicators)
     
     for i in range(0, n_indicators):
-        ax = fig.add_subplot(n_indicators, 1, i + 1)
+        ax = axes[i, 0]
 
         indicator_dict = dfn.indicators[indicator_names[i]]
         if indicator_dict["time"] == "quarter":
-            u.plot_quarterly_data(indicators_data_dict[indicator_names[i]], dfn.start_year, 1, dfn.end_year, 4, \
+            u.plot_quarterly_data(aligned[indicator_names[i]], aligned.start_year, 1, aligned.end_year, 4, \
             axes_object = ax, title = indicator_dict["title"])
         else:
-            u.plot_monthly_data(indicators_data_dict[indicator_names[i]], dfn.start_year, 1, dfn.end_year, 12, \
+            u.plot_monthly_data(aligned[indicator_names[i]], aligned.start_year, 1, aligned.end_year, 12, \
             axes_object = ax, title = indicator_dict["title"])
  
     plt.tight_layout()
     plt.show()
 
 def plot_feature_histograms(df, n_bins = 50):
+    import matplotlib.pyplot as plt
     n_plots = len(df.select_dtypes(include=['float64']).columns)
-    fig = plt.figure()
-    plot_index = 1
+    fig, axes = plt.subplots(n_plots, 1, squeeze = False)
+    plot_index = 0
     
     for indk in dfn.indicators.keys():
         ind = dfn.indicators[indk]
         if ind["df column"] in df.columns:
-            ax = fig.add_subplot(n_plots, 1, plot_index)
+            ax = axes[plot_index, 0]
             ax.hist(df[ind["df column"]], bins = n_bins)
             ax.set_title(ind["title"])
             ax.set_xbound([-1, 1])
@@ -65,6 +129,7 @@ def plot_feature_histograms(df, n_bins = 50):
     plt.show()
 
 def plot_feature_corr(df):
+    import seaborn as sns
     corr_data = df.select_dtypes(include=['float64']).corr()
     mask = np.zeros_like(corr_data, dtype=np.bool)
     mask[np.triu_indices_from(mask)] = True
@@ -77,47 +142,66 @@ def plot_feature_corr(df):
 #   the range specified in definitions file.
 # - diff: True if we are looking at the difference from last month's stock price
 #   instead of raw price.
-def get_correlations_sp_500(indicator_data, lag, diff = False):
+# - n_workers: number of worker processes (defaults to the number of cores).
+def get_correlations_sp_500(indicator_data, lag, diff = False, n_workers = None):
+    return get_correlations(get_sp_500_stocks(), indicator_data, lag, diff, n_workers)
+
+# Ticker symbols of the S&P 500 companies, as used in the stock file names.
+def get_sp_500_stocks():
+    import pandas as pd
     sp_df = pd.read_csv("data/S&P_stocks.csv")
-    sp_stocks = sp_df.Name.tolist()
-    df = pd.DataFrame()
-    failures = []
-
-    for st in sp_stocks:
-        try:
-            st = st.replace(".", "-")
-            print "Processing stock %s" % st
-            c = corr_indicators(st, indicator_data, lag, diff)
-            if len(df.count()) == 0:
-                df = pd.DataFrame(c, index=[0])
-            else:
-                df = df.append(c, ignore_index = True)
-        except:
-            print "Processing of stock %s failed" % st
-            failures.append(st)
-    # Reorder columns so name is on left.
-    df = df[['Name'] + df.drop('Name', axis = 1).columns.tolist()]
-    return df, failures
+    return [st.replace(".", "-") for st in sp_df.Name.tolist()]
+
+# Extract correlation features for a list of stocks, spread across a process pool.
+# Returns a dataframe with one row per stock, and a dataframe of failures with
+# the name of the stock, the exception type and the reason it failed.
+# - out: results folder (see results_io.py) to write rows to in chunks of chunk_size
+#   stocks as they finish, instead of returning them (the dataframe returned is None).
+def get_correlations(stocks, indicator_data, lag, diff = False, n_workers = None, out = None, \
+        chunk_size = 100):
+    import pandas as pd
+    import results_io
+    indicator_data = as_aligned(indicator_data)
+    columns = ["Name"] + sorted(dfn.indicators[ind]["df column"] for ind in indicator_data.keys())
+    writer = None if out is None else results_io.ResultsWriter(out)
+    # Stock data is read in the workers, and correlations are computed for a chunk of stocks at once.
+    collector = results_io.ChunkCollector(lambda pending: correlation_frame(pending, indicator_data, columns), \
+            columns, writer, chunk_size)
+    rows, failures = u.run_batch(get_stock_data_for_correlation, stocks, (lag, diff), n_workers, \
+            on_result = collector.add_result, on_failure = collector.add_failure)
+    collector.flush()
+    failures_df = pd.DataFrame(failures, columns = ["Name", "error", "reason"])
+    if writer is not None:
+        return None, failures_df
+    return collector.frame(), failures_df
 
+# Dataframe of correlation features for a list of (stock, (monthly, quarterly)) pairs,
+# with the columns of get_correlations.
+def correlation_frame(stock_data, indicator_data, columns = None):
+    import pandas as pd
+    if columns is None:
+        columns = ["Name"] + sorted(dfn.indicators[ind]["df column"] for ind in indicator_data.keys())
+    with instrument.stage("correlation", rows = len(stock_data)):
+        r, indicators = corr_with_indicators([res[0] for st, res in stock_data], \
+                [res[1] for st, res in stock_data], indicator_data)
+    with instrument.stage("dataframe", rows = len(stock_data)):
+        df = pd.DataFrame(r, columns = [dfn.indicators[ind]["df column"] for ind in indicators])
+        df['Name'] = [st for st, res in stock_data]
+        # Reorder columns so name is on left.
+        return df[columns]
 
 def corr_indicators(stock_file, indicator_data, lag, diff = False):
-    stock_monthly_data = get_monthly_stock_data_for_correlation(stock_file, lag, diff)
-    stock_quarterly_data = get_quarterly_stock_data_for_correlation(stock_file, lag, diff)
+    stock_monthly_data, stock_quarterly_data = get_stock_data_for_correlation(stock_file, lag, diff)
+    r, indicators = corr_with_indicators(stock_monthly_data, stock_quarterly_data, indicator_data)
     stock_corr = {}
     stock_corr['Name'] = stock_file
-    
-    for indicator in indicator_data.keys():
-        if dfn.indicators[indicator]["time"] == "quarter":
-            stock_corr[dfn.indicators[indicator]["df column"]] = \
-                    np.corrcoef(stock_quarterly_data, indicator_data[indicator])[0][1]
-        else:
-            stock_corr[dfn.indicators[indicator]["df column"]] = \
-                    np.corrcoef(stock_monthly_data, indicator_data[indicator])[0][1]
-
+    for i, indicator in enumerate(indicators):
+        stock_corr[dfn.indicators[indicator]["df column"]] = r[0, i]
     return stock_corr
 
 
 def standardize_correlations(corr_df):
+    import pandas as pd
     from sklearn import preprocessing
     # Scale each numeric column to mean of 0 and std of 1.
     num_cols = corr_df.select_dtypes(include=["float64"])
@@ -127,8 +211,53 @@ def standardize_correlations(corr_df):
     scaled_df = scaled_df.join(corr_df.select_dtypes(exclude=["float64"]))
     return scaled_df
 
+# ********** Rolling correlations **********
+
+# Correlations of stocks with the monthly (or quarterly) indicators over a window that
+# slides through [start_year, end_year] (defaults to the range in definitions file).
+# - window: window length in periods of the given time resolution, or None for
+#   windows expanding from start_year.
+# - lag, diff: as in corr_indicators (lag is in months, see apply_lag_in_quarters
+#   for quarters). Stock data is read over the lagged range, with NaN in missing
+#   periods, so windows before a stock starts trading get NaN. The same goes for
+#   windows where an indicator has no data.
+# Returns RollingCorrelations with an (stocks x indicators x window ends) array and
+# the month of the last period of each window, and the failures dataframe for stocks
+# that could not be read.
+RollingCorrelations = namedtuple("RollingCorrelations", ["stocks", "indicators", "window_ends", "r"])
+
+def get_rolling_correlations(stocks, window, period = "month", lag = 0, diff = False, \
+        start_year = None, end_year = None, n_workers = None):
+    import pandas as pd
+    start_year = dfn.start_year if start_year is None else start_year
+    end_year = dfn.end_year if end_year is None else end_year
+    aligned = align_indicators(start_year = start_year, end_year = end_year, allow_missing = True)
+    indicators = aligned.columns[period]
+    indicator_rows = aligned.matrix(period)
+
+    stock_window = lagged_windows(period, [lag], [diff], start_year, end_year)[(lag, diff)]
+    stock_range = period_range(period, *stock_window)
+    results, failures = u.run_batch(u.get_stock_period_data, stocks, (period,) + stock_range + (True,), \
+            n_workers)
+    failed = set(f["Name"] for f in failures)
+    stock_rows = np.array([np.diff(res) if diff else res for res in results], dtype = np.float64) \
+            .reshape(len(results), aligned.n_periods(period))
+
+    r, ends = rolling_corr_matrix(stock_rows, indicator_rows, window)
+    first = start_year * u.periods_per_year[period]
+    months_per_period = 12 / u.periods_per_year[period]
+    window_ends = ((first + ends + 1) * months_per_period - 1 - 1970 * 12).astype("datetime64[M]")
+    return RollingCorrelations([st for st in stocks if st not in failed], \
+            [dfn.indicators[ind]["df column"] for ind in indicators], window_ends, r), \
+            pd.DataFrame(failures, columns = ["Name", "error", "reason"])
+
 # ********** Helper functions for stock prices / indicator correlations **********
 
+# Monthly and quarterly stock data matching the indicator data, for a lag in months.
+def get_stock_data_for_correlation(stock_file, lag, diff = False):
+    return get_monthly_stock_data_for_correlation(stock_file, lag, diff), \
+            get_quarterly_stock_data_for_correlation(stock_file, lag, diff)
+
 def get_monthly_stock_data_for_correlation(stock_file, lag, diff = False):
     # lag: Lag (in cc1months) of stock data following indicator.
     # For example:q
@@ -139,7 +268,7 @@ def get_monthly_stock_data_for_correlation(stock_file, lag, diff = False):
     # Start year for indicator data begins at month 1,
     # end year ends at month 12.
     stock_start_year, stock_start_month, stock_end_year, stock_end_month = \
-            u.apply_lag_in_months(dfn.start_year, dfn.end_year, lag, diff)
+            period_range("month", *lagged_windows("month", [lag], [diff])[(lag, diff)])
     stock_monthly_data = u.get_stock_monthly_data(stock_file, stock_start_year, \
             stock_start_month, stock_end_year, stock_end_month)
     if diff:
@@ -148,14 +277,13 @@ def get_monthly_stock_data_for_correlation(stock_file, lag, diff = False):
         return stock_monthly_data
 
 def get_quarterly_stock_data_for_correlation(stock_file, lag, diff = False):
-    # lag: Same as monthly data, adjusted to quarterly data.
-    quarter_lag = lag / 3 + 1
+    # lag: Same as monthly data, adjusted to quarterly data (lag / 3 + 1 quarters).
 
     # Adjust dates for which to extract stock data based on correlation lag.
     # Start year for indicator data begins at quarter 1, 
     # end year ends at quarter 4.
     stock_start_year, stock_start_quarter, stock_end_year, stock_end_quarter = \
-            u.apply_lag_in_quarters(dfn.start_year, dfn.end_year, quarter_lag, diff)
+            period_range("quarter", *lagged_windows("quarter", [lag], [diff])[(lag, diff)])
     stock_quarterly_data = u.get_stock_quarterly_data(stock_file, stock_start_year, \
             stock_start_quarter, stock_end_year, stock_end_quarter)
     if diff:
@@ -163,14 +291,161 @@ def get_quarterly_stock_data_for_correlation(stock_file, lag, diff = False):
     else:
         return stock_quarterly_data
 
+# ********** Correlations across many lags in one pass **********
+
+# Correlations of every stock with every indicator for each lag (in months) and
+# each diff setting, in long format with columns Name, indicator, lag, diff and r.
+# Each stock is read and aggregated once, over the union of the windows of all lags.
+# Lags for which the stock does not cover the whole window get a correlation of NaN.
+# With out, rows are written to that results folder in chunks of chunk_size stocks
+# as they finish, as in get_correlations.
+def sweep_lags(stocks, indicator_data, lags = range(0, 25), diffs = (False, True), n_workers = None, \
+        out = None, chunk_size = 100):
+    import pandas as pd
+    import results_io
+    columns = ["Name", "indicator", "lag", "diff", "r"]
+    writer = None if out is None else results_io.ResultsWriter(out)
+    collector = results_io.ChunkCollector(lambda pending: pd.DataFrame([r for stock, stock_rows in pending \
+            for r in stock_rows], columns = columns), columns, writer, chunk_size)
+    rows, failures = u.run_batch(sweep_lags_stock, stocks, (as_aligned(indicator_data), list(lags), list(diffs)), \
+            n_workers, on_result = collector.add_result, on_failure = collector.add_failure)
+    collector.flush()
+    failures_df = pd.DataFrame(failures, columns = ["Name", "error", "reason"])
+    if writer is not None:
+        return None, failures_df
+    return collector.frame(), failures_df
+
+def sweep_lags_sp_500(indicator_data, lags = range(0, 25), diffs = (False, True), n_workers = None):
+    return sweep_lags(get_sp_500_stocks(), indicator_data, lags, diffs, n_workers)
+
+# Stock windows for the indicator window of the years [start_year, end_year] (those of
+# definitions file by default, see aligned.lag_window). Returns the window [start, stop)
+# of period indices (see utils.period_index) for each (lag, diff).
+def lagged_windows(period, lags, diffs, start_year = None, end_year = None):
+    start_year = dfn.start_year if start_year is None else start_year
+    end_year = dfn.end_year if end_year is None else end_year
+    n_periods = u.periods_per_year[period]
+    first = start_year * n_periods
+    n = (end_year - start_year + 1) * n_periods
+    return dict(((lag, diff), lag_window(period, lag, diff, first, n)) for lag in lags for diff in diffs)
+
+def _period_data_for_windows(stock_file, period, windows):
+    first = min(w[0] for w in windows.values())
+    last = max(w[1] for w in windows.values()) - 1
+    data = u.get_stock_period_data(stock_file, period, *period_range(period, first, last + 1), \
+            allow_missing = True)
+    return data, first
+
+def sweep_lags_stock(stock_file, indicator_data, lags, diffs):
+    indicators = sorted(indicator_data.keys())
+    keys = [(lag, diff) for diff in diffs for lag in lags]
+    r = np.empty((len(keys), len(indicators)))
+    for period in ["month", "quarter"]:
+        columns = [i for i, ind in enumerate(indicators) if indicator_period(ind) == period]
+        if len(columns) == 0:
+            continue
+        windows = lagged_windows(period, lags, diffs)
+        data, first = _period_data_for_windows(stock_file, period, windows)
+        # One row per (lag, diff), each a shifted view of the same aggregated data.
+        # Windows with missing periods give NaN correlations.
+        stock_data = []
+        for lag, diff in keys:
+            start, stop = windows[(lag, diff)]
+            window = data[start - first:stop - first]
+            stock_data.append(np.diff(window) if diff else window)
+        r[:, columns] = corr_matrix(np.array(stock_data), indicator_matrix(indicator_data, indicators, period))
+
+    rows = []
+    for k, (lag, diff) in enumerate(keys):
+        for i, indicator in enumerate(indicators):
+            rows.append({"Name" : stock_file, "indicator" : dfn.indicators[indicator]["df column"], \
+                    "lag" : lag, "diff" : bool(diff), "r" : r[k, i]})
+    return rows
+
+# ********** Lead-lag analysis **********
+
+# Correlation of every stock with every indicator as a function of the lag, for all
+# lags at once. Results are the same as corr_indicators or sweep_lags for each lag
+# (in months; quarterly indicators use lag / 3 + 1 quarters), but stocks are read
+# once and all lags of all stocks are computed together with FFT cross-correlations.
+# - r: (stocks x indicators x lags) array, the profile of each pair.
+# - best_lag, best_r: lag with the largest absolute correlation, and that correlation
+#   (stocks x indicators). Pairs without any correlation get NaN.
+LeadLag = namedtuple("LeadLag", ["stocks", "indicators", "lags", "r", "best_lag", "best_r"])
+
+def get_lead_lag(stocks, indicator_data, lags = range(0, 25), diff = False, n_workers = None):
+    import pandas as pd
+    aligned = as_aligned(indicator_data)
+    lags = list(lags)
+    results, failures = u.run_batch(_lead_lag_stock_data, stocks, (lags, diff), n_workers)
+    failed = set(f["Name"] for f in failures)
+    names = [st for st in stocks if st not in failed]
+
+    indicators = aligned.indicators
+    r = np.full((len(names), len(indicators), len(lags)), np.nan)
+    for p, period in enumerate(["month", "quarter"]):
+        columns = [i for i, ind in enumerate(indicators) if indicator_period(ind) == period]
+        if len(columns) == 0 or len(names) == 0:
+            continue
+        stock_data = np.array([res[p] for res in results], dtype = np.float64)
+        if diff:
+            stock_data = np.diff(stock_data, axis = 1)
+        # Shift of each lag from the first stock window.
+        starts = lagged_windows(period, lags, [diff])
+        first = min(w[0] for w in starts.values())
+        shifts = [starts[(lag, diff)][0] - first for lag in lags]
+        with instrument.stage("lead-lag %s" % period, rows = len(names)):
+            profile = shifted_corr_matrix(stock_data, aligned.matrix(period))
+        r[:, columns, :] = profile[:, :, shifts]
+
+    with np.errstate(invalid = "ignore"):
+        best = np.argmax(np.where(np.isnan(r), -1, np.abs(r)), axis = 2)
+    best_r = r[np.arange(r.shape[0])[:, np.newaxis], np.arange(r.shape[1])[np.newaxis, :], best]
+    best_lag = np.where(np.isnan(best_r), np.nan, np.array(lags, dtype = np.float64)[best])
+    return LeadLag(names, [dfn.indicators[ind]["df column"] for ind in indicators], lags, r, best_lag, best_r), \
+            pd.DataFrame(failures, columns = ["Name", "error", "reason"])
+
+def get_lead_lag_sp_500(indicator_data, lags = range(0, 25), diff = False, n_workers = None):
+    return get_lead_lag(get_sp_500_stocks(), indicator_data, lags, diff, n_workers)
+
+# Monthly and quarterly data of a stock over the union of the windows of all lags.
+def _lead_lag_stock_data(stock_file, lags, diff):
+    return tuple(_period_data_for_windows(stock_file, period, lagged_windows(period, lags, [diff]))[0] \
+            for period in ["month", "quarter"])
+
+# Best lag and correlation of each stock and indicator, in long format with columns
+# Name, indicator, best_lag and r.
+def lead_lag_summary(lead_lag):
+    import pandas as pd
+    n_stocks, n_indicators = lead_lag.best_r.shape
+    return pd.DataFrame({"Name" : np.repeat(lead_lag.stocks, n_indicators), \
+            "indicator" : np.tile(lead_lag.indicators, n_stocks), \
+            "best_lag" : lead_lag.best_lag.ravel(), "r" : lead_lag.best_r.ravel()}, \
+            columns = ["Name", "indicator", "best_lag", "r"])
+
+# Clustering features from a lead-lag analysis, one row per stock with a Name column:
+# - with profile, the correlation at every lag (columns <indicator>_lag_<lag>),
+# - otherwise the best correlation (columns <indicator>) and its lag (<indicator>_best_lag).
+# Feature columns are float64, as expected by standardize_correlations.
+def lead_lag_features(lead_lag, profile = False):
+    import pandas as pd
+    if profile:
+        columns = ["%s_lag_%d" % (ind.strip(), lag) for ind in lead_lag.indicators for lag in lead_lag.lags]
+        df = pd.DataFrame(lead_lag.r.reshape(len(lead_lag.stocks), -1), columns = columns)
+    else:
+        df = pd.DataFrame(lead_lag.best_r, columns = lead_lag.indicators)
+        for i, ind in enumerate(lead_lag.indicators):
+            df["%s_best_lag" % ind.strip()] = lead_lag.best_lag[:, i]
+    df.insert(0, "Name", lead_lag.stocks)
+    return df
+
 
 
 
 
 
-indicator_data = {}
-for indicator in dfn.indicators.keys():
-    indicator_data[indicator] = get_indicator_data(dfn.indicators[indicator])
+# Data of all indicators, loaded on first access. Use load_indicators() to load them all at once.
+indicator_data = IndicatorData(dfn.indicators)
 
 # plot_indicators(indicator_data)
 #c, f = get_correlations_sp_500(indicator_data, diff = False)
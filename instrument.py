@@ -0,0 +1,188 @@
+# Instrumentation of the pipeline stages.
+# Off by default: stage() then returns a shared object that does nothing, so the
+# hooks left in the code cost a function call. When enabled, every stage records
+# its wall time, the rows processed and the bytes read, with the stock it ran for.
+# Events recorded in the worker processes of run_batch are sent back with the results.
+#   instrument.enable()                    # also logs progress to stderr
+#   df, failures = ind.get_correlations_sp_500(ind.indicator_data, 1)
+#   print(instrument.summary_table())
+#   instrument.write_trace("trace.json")   # open in chrome://tracing or ui.perfetto.dev
+#
+#   with instrument.stage("read csv", stock) as s:
+#       ...
+#       s.rows = len(df)
+
+import json
+import logging
+import os
+import threading
+import time
+
+enabled = False
+_events = []
+
+# Progress (INFO) and failures (WARNING) of batch runs are reported on this logger.
+# Nothing is printed unless the application configures logging, or calls
+# log_to_stderr (as enable and the command line scripts do).
+logger = logging.getLogger("stocks")
+logger.addHandler(logging.NullHandler())
+_stderr_handler = None
+
+
+class _NoStage(object):
+    # Used when instrumentation is off; attributes set on it are ignored.
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+_no_stage = _NoStage()
+
+
+class _Stage(object):
+
+    def __init__(self, name, stock, rows, nbytes):
+        self.name = name
+        self.stock = stock
+        self.rows = rows
+        self.bytes = nbytes
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        end = time.time()
+        _events.append({"name" : self.name, "stock" : self.stock, "start" : self.start, \
+                "duration" : end - self.start, "rows" : self.rows, "bytes" : self.bytes, \
+                "pid" : os.getpid(), "tid" : threading.current_thread().ident})
+        return False
+
+# Context manager timing a stage, optionally for a stock. rows and bytes can be
+# given here or set on the object returned, inside the with block.
+def stage(name, stock = None, rows = 0, nbytes = 0):
+    if not enabled:
+        return _no_stage
+    return _Stage(name, stock, rows, nbytes)
+
+# Print the messages of the logger at level and above to stderr.
+def log_to_stderr(level = logging.INFO):
+    global _stderr_handler
+    if _stderr_handler is None:
+        _stderr_handler = logging.StreamHandler()
+        _stderr_handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(_stderr_handler)
+    logger.setLevel(level)
+
+# Turn instrumentation on or off. With progress, batch runs also log progress and
+# failures to stderr.
+def enable(on = True, progress = True):
+    global enabled
+    enabled = on
+    if on and progress:
+        log_to_stderr(logging.INFO)
+    elif _stderr_handler is not None:
+        logger.setLevel(logging.WARNING)
+
+def disable():
+    enable(False)
+
+def reset():
+    del _events[:]
+
+def events():
+    return list(_events)
+
+# Remove and return the events recorded so far, e.g. to send them from a worker process.
+def drain():
+    drained = list(_events)
+    del _events[:]
+    return drained
+
+def add_events(new_events):
+    _events.extend(new_events)
+
+
+# ********** Reports **********
+
+# Totals by stage: number of calls, stocks, wall time, rows and bytes, slowest first.
+# Time is summed over processes, so with a pool it can exceed the elapsed time.
+def summary(event_list = None):
+    import pandas as pd
+    event_list = _events if event_list is None else event_list
+    columns = ["stage", "calls", "stocks", "seconds", "mean_ms", "rows", "MB"]
+    stages = {}
+    for e in event_list:
+        s = stages.setdefault(e["name"], {"calls" : 0, "stocks" : set(), "seconds" : 0.0, "rows" : 0, "bytes" : 0})
+        s["calls"] += 1
+        if e["stock"] is not None:
+            s["stocks"].add(e["stock"])
+        s["seconds"] += e["duration"]
+        s["rows"] += e["rows"]
+        s["bytes"] += e["bytes"]
+    rows = [{"stage" : name, "calls" : s["calls"], "stocks" : len(s["stocks"]), "seconds" : s["seconds"], \
+            "mean_ms" : 1000 * s["seconds"] / s["calls"], "rows" : s["rows"], "MB" : s["bytes"] / 1e6} \
+            for name, s in stages.items()]
+    df = pd.DataFrame(rows, columns = columns)
+    return df.sort_values("seconds", ascending = False).reset_index(drop = True)
+
+# Totals by stage and stock, for finding the stocks that are slow in a stage.
+def summary_by_stock(event_list = None):
+    import pandas as pd
+    event_list = _events if event_list is None else event_list
+    df = pd.DataFrame([e for e in event_list if e["stock"] is not None], \
+            columns = ["name", "stock", "duration", "rows", "bytes"])
+    df = df.groupby(["name", "stock"])[["duration", "rows", "bytes"]].sum().reset_index()
+    df.columns = ["stage", "stock", "seconds", "rows", "bytes"]
+    return df.sort_values("seconds", ascending = False).reset_index(drop = True)
+
+def summary_table(event_list = None):
+    return summary(event_list).to_string(index = False, float_format = lambda v: "%.3f" % v)
+
+# Write the events in the Chrome trace event format, one track per process and thread.
+def write_trace(path, event_list = None):
+    event_list = _events if event_list is None else event_list
+    t0 = min(e["start"] for e in event_list) if event_list else 0
+    trace = []
+    for e in event_list:
+        args = {"rows" : e["rows"], "bytes" : e["bytes"]}
+        if e["stock"] is not None:
+            args["stock"] = e["stock"]
+        trace.append({"name" : e["name"], "cat" : "pipeline", "ph" : "X", "pid" : e["pid"], "tid" : e["tid"], \
+                "ts" : int(1e6 * (e["start"] - t0)), "dur" : int(1e6 * e["duration"]), "args" : args})
+    with open(path, "w") as f:
+        json.dump({"traceEvents" : trace, "displayTimeUnit" : "ms"}, f)
+    return path
+
+
+# ********** Progress of batch runs **********
+
+class Progress(object):
+    # Logs the number of tasks processed about every interval seconds, and failures as they happen.
+    # label names the tasks, and item is a format naming one task.
+
+    def __init__(self, total, label = "stocks", interval = 5.0, item = "stock %s"):
+        self.total = total
+        self.label = label
+        self.item = item
+        self.interval = interval
+        self.done = 0
+        self.failed = 0
+        self.start = time.time()
+        self.last = self.start
+
+    def update(self, task, failure = None):
+        self.done += 1
+        if failure is not None:
+            self.failed += 1
+            logger.warning("Processing of %s failed: %s", self.item % (task,), failure["reason"])
+        now = time.time()
+        if now - self.last >= self.interval or self.done == self.total:
+            self.last = now
+            logger.info("Processed %d/%s %s (%d failed) in %.1f s", self.done, self.total, self.label, \
+                    self.failed, now - self.start)
@@ -0,0 +1,214 @@
+# Plots of monthly and quarterly series drawn from already aggregated arrays.
+# - plot_lines draws one line per series, which can be labelled for a legend and
+#   can have different lengths. It is used by the plots of utils.
+# - plot_series draws many series of the same length as one LineCollection, for
+#   charts of many stocks such as cluster_report.
+# - Axis labels of a window of periods are built once and cached.
+# - Figures for files are made without pyplot (on the Agg canvas), so images can be
+#   written in bulk without a display and without figures piling up in pyplot.
+#   prices, names = stock_matrix(stocks, lag = 0)            # read every stock once
+#   cluster_report(prices, names, labels, "report/", scaled = True)
+
+import os
+
+import numpy as np
+
+import definitions as dfn
+import utils as u
+
+# Labels of the periods of a window, keyed by (period, start_year, start_period, end_year, end_period).
+_axis_labels = {}
+
+
+# ********** Axis labels **********
+
+# Labels such as 2010/1 for each period from (start_year, start_period) to (end_year, end_period) inclusive.
+def axis_labels(period, start_year, start_period, end_year, end_period):
+    key = (period, start_year, start_period, end_year, end_period)
+    if not _axis_labels.has_key(key):
+        n_periods = u.periods_per_year[period]
+        index = np.arange(start_year * n_periods + start_period - 1, end_year * n_periods + end_period)
+        _axis_labels[key] = tuple("%d/%d" % (p // n_periods, p % n_periods + 1) for p in index)
+    return _axis_labels[key]
+
+# Show the labels of the periods at the integer x positions of the ticks.
+def set_period_axis(ax, labels):
+    from matplotlib.ticker import FuncFormatter, MaxNLocator
+
+    def label(x, pos):
+        i = int(round(x))
+        return labels[i] if 0 <= i < len(labels) and abs(x - i) < 1e-6 else ""
+
+    ax.xaxis.set_major_locator(MaxNLocator(nbins = 6, integer = True))
+    ax.xaxis.set_major_formatter(FuncFormatter(label))
+
+
+# ********** Drawing series **********
+
+def _new_axes(axes_object):
+    if axes_object != "":
+        return axes_object
+    import matplotlib.pyplot as plt
+    fig, ax = plt.subplots(1, 1)
+    return ax
+
+# Draw the rows of data (series x periods, or a single series) as one LineCollection.
+# Missing (NaN) values leave gaps. Colors cycle through the colors of the axes style
+# unless given. Returns the collection.
+def draw_lines(ax, data, colors = None, linewidth = 1.0, alpha = 1.0):
+    from matplotlib.collections import LineCollection
+    rows = np.atleast_2d(np.asarray(data, dtype = np.float64))
+    segments = np.empty(rows.shape + (2,))
+    segments[:, :, 0] = np.arange(rows.shape[1])
+    segments[:, :, 1] = rows
+    if colors is None:
+        import matplotlib
+        cycle = [c["color"] for c in matplotlib.rcParams["axes.prop_cycle"]]
+        colors = [cycle[i % len(cycle)] for i in range(len(rows))]
+    lines = LineCollection(np.ma.masked_invalid(segments), colors = colors, linewidths = linewidth, \
+            alpha = alpha)
+    ax.add_collection(lines)
+    ax.autoscale_view()
+    return lines
+
+# A series, an array of series or a list of series (possibly of different lengths) as a list of series.
+def series_list(data):
+    if isinstance(data, np.ndarray):
+        return list(np.atleast_2d(data))
+    if len(data) > 0 and np.ndim(data[0]) == 0:
+        return [data]
+    return list(data)
+
+def _set_labels(ax, period, start_year, start_period, end_year, end_period, title, xlabel, ylabel):
+    ax.set_title(title)
+    ax.set_xlabel(("Month" if period == "month" else "Quarter") if xlabel is None else xlabel)
+    ax.set_ylabel(ylabel)
+    set_period_axis(ax, axis_labels(period, start_year, start_period, end_year, end_period))
+
+# Plot monthly or quarterly series over the periods (start_year, start_period) to
+# (end_year, end_period), with period labels on the x axis, as one line per series.
+# - data: a series, or several series as an array or list (see series_list).
+# - labels: label of each series, shown by ax.legend().
+# - axes_object: axes to draw on, or "" for a new figure.
+def plot_lines(data, period, start_year, start_period, end_year, end_period, axes_object = "", \
+        title = "", xlabel = None, ylabel = "", labels = None):
+    ax = _new_axes(axes_object)
+    series = series_list(data)
+    labels = [None] * len(series) if labels is None else list(labels)
+    for line, label in zip(series, labels):
+        ax.plot(line, label = label)
+    _set_labels(ax, period, start_year, start_period, end_year, end_period, title, xlabel, ylabel)
+    return ax
+
+# Same as plot_lines, with all series drawn as one LineCollection. Series must have
+# the same length.
+def plot_series(data, period, start_year, start_period, end_year, end_period, axes_object = "", \
+        title = "", xlabel = None, ylabel = "", colors = None, linewidth = 1.0, alpha = 1.0):
+    ax = _new_axes(axes_object)
+    draw_lines(ax, data, colors, linewidth, alpha)
+    _set_labels(ax, period, start_year, start_period, end_year, end_period, title, xlabel, ylabel)
+    return ax
+
+# One row of subplots per series group, created at once.
+# - panels: list of (title, data) pairs, data as in plot_series.
+def plot_panels(panels, period, start_year, start_period, end_year, end_period, height = 1.5, \
+        figure = None):
+    if figure is None:
+        import matplotlib.pyplot as plt
+        fig, axes = plt.subplots(len(panels), 1, squeeze = False)
+    else:
+        fig = figure
+        axes = fig.subplots(len(panels), 1, squeeze = False)
+    fig.set_size_inches(6, height * len(panels))
+    for ax, (title, data) in zip(axes[:, 0], panels):
+        plot_series(data, period, start_year, start_period, end_year, end_period, axes_object = ax, title = title)
+    fig.tight_layout()
+    return fig
+
+
+# ********** Stock prices **********
+
+# Monthly (or quarterly) mean prices of stocks over the window of definitions file for a
+# lag in months, read once for plotting several times. Stocks with missing periods
+# have NaN there. Returns the (stocks x periods) array, the stocks read, and the window
+# as (start_year, start_period, end_year, end_period).
+def stock_matrix(stocks, lag = 0, period = "month", n_workers = None):
+    import aligned
+    import indicator_correlation as ind
+    start, stop = ind.lagged_windows(period, [lag], [False])[(lag, False)]
+    window = aligned.period_range(period, start, stop)
+    results, failures = u.run_batch(u.get_stock_period_data, stocks, (period,) + window + (True,), n_workers)
+    failed = set(f["Name"] for f in failures)
+    names = [st for st in stocks if st not in failed]
+    return np.array(results, dtype = np.float64).reshape(len(names), stop - start), names, window
+
+# Rows divided by their mean, so that stocks of different prices can be compared.
+def scale_rows(data):
+    data = np.atleast_2d(np.asarray(data, dtype = np.float64))
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        return data / np.nanmean(data, axis = 1)[:, np.newaxis]
+
+
+# ********** Images in bulk **********
+
+# Switch pyplot to the Agg backend, so that the pyplot based plots (such as those of
+# utils and indicator_correlation) can be drawn and saved without a display.
+def use_headless():
+    import matplotlib.pyplot as plt
+    plt.switch_backend("Agg")
+
+# New figure on the Agg canvas, not registered with pyplot, so it is freed when no
+# longer referenced and needs no display.
+def headless_figure(width = 6, height = 4, dpi = 100):
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    fig = Figure(figsize = (width, height), dpi = dpi)
+    FigureCanvasAgg(fig)
+    return fig
+
+# Write (name, figure) pairs to out_dir as name.<fmt>. Figures made with pyplot are
+# closed once written. Returns the paths written.
+def save_figures(figures, out_dir, fmt = "png", dpi = 100):
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    paths = []
+    for name, fig in figures:
+        path = os.path.join(out_dir, "%s.%s" % (name, fmt))
+        fig.savefig(path, dpi = dpi)
+        # Only pyplot figures have a number.
+        if hasattr(fig, "number"):
+            import matplotlib.pyplot as plt
+            plt.close(fig)
+        paths.append(path)
+    return paths
+
+# Price charts of the members of each cluster, one image per cluster, written to out_dir
+# with clusters.csv listing the cluster of each stock.
+# - data, names: stock prices and stocks, as returned by stock_matrix.
+# - labels: cluster of each stock (e.g. labels_ of a Kmeans model), in the order of names.
+# - window: (start_year, start_period, end_year, end_period) of the data.
+# - scaled: divide each stock by its mean.
+def cluster_report(data, names, labels, out_dir, window = None, period = "month", scaled = True, \
+        fmt = "png", dpi = 100):
+    if window is None:
+        window = (dfn.start_year, 1, dfn.end_year, u.periods_per_year[period])
+    data = scale_rows(data) if scaled else np.atleast_2d(np.asarray(data, dtype = np.float64))
+    labels = np.asarray(labels)
+
+    def figures():
+        for cluster in np.unique(labels):
+            members = np.flatnonzero(labels == cluster)
+            fig = headless_figure()
+            ax = fig.add_subplot(1, 1, 1)
+            plot_series(data[members], period, *window, axes_object = ax, \
+                    title = "Cluster %s (%d stocks)" % (cluster, len(members)), \
+                    ylabel = ("scaled " * scaled) + "stock price", alpha = 0.6)
+            fig.tight_layout()
+            yield "cluster_%s" % cluster, fig
+
+    paths = save_figures(figures(), out_dir, fmt, dpi)
+    with open(os.path.join(out_dir, "clusters.csv"), "w") as f:
+        f.write("Name,cluster\n")
+        for name, cluster in zip(names, labels):
+            f.write("%s,%s\n" % (name, cluster))
+    return paths
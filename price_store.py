@@ -0,0 +1,213 @@
+# Columnar store of daily closing prices.
+# Converts the folder of <ticker>.us.txt stock files (see data/readme.txt) into a
+# shared date axis and a (tickers x dates) matrix of closing prices, which is
+# memory-mapped from disk so stock loaders can read a ticker without parsing text.
+# Build or refresh it with:
+#   python price_store.py --src data/stocks --store data/store
+# Only tickers whose source files changed since the last build are parsed again.
+
+import argparse
+import glob
+import json
+import os
+
+import numpy as np
+
+import utils as u
+
+default_src_dir = "data/stocks"
+default_store_dir = "data/store"
+stock_file_suffix = ".us.txt"
+
+
+# ********** Reading the store **********
+
+class PriceStore(object):
+    # Files in the store folder:
+    # - dates.npy: sorted union of the dates of all tickers (datetime64[D]).
+    # - close.npy: closing prices, one row per ticker, NaN where a ticker has no entry.
+    # - index.json: dtype, and for each ticker its row, the slice [start, stop) of the
+    #   date axis between its first and last entry, the dates of its entries with an
+    #   empty Close value (in days since 1970-01-01), and the size and modification
+    #   time of the source file it was built from.
+
+    def __init__(self, store_dir = default_store_dir):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, "index.json")) as f:
+            index = json.load(f)
+        self.dtype = np.dtype(index["dtype"])
+        self.tickers = index["tickers"]
+        self.dates = np.load(os.path.join(store_dir, "dates.npy"))
+        self.close = np.load(os.path.join(store_dir, "close.npy"), mmap_mode = "r")
+        self._period_index = {}
+
+    def __contains__(self, ticker):
+        return ticker.lower() in self.tickers
+
+    def __len__(self):
+        return len(self.tickers)
+
+    def is_current(self, ticker, source_file):
+        entry = self.tickers.get(ticker.lower())
+        stat = os.stat(source_file)
+        # Stores built before empty Close values were recorded are parsed again.
+        return entry is not None and entry.has_key("empty") and entry["size"] == stat.st_size and \
+                entry["mtime"] == stat.st_mtime
+
+    # Closing prices and dates of a ticker between its first and last entry.
+    # Both are views into the store, no data is copied.
+    def close_prices(self, ticker):
+        entry = self.tickers[ticker.lower()]
+        return self.close[entry["row"], entry["start"]:entry["stop"]], \
+                self.dates[entry["start"]:entry["stop"]]
+
+    # Closing prices of the entries of a ticker, NaN where the Close value was empty,
+    # with the calendar period index of each (see utils.period_index), as they would
+    # be read from its stock file. Only the slice of the ticker is read from the store,
+    # and its entries are copied out of it (use close_prices for views without copies).
+    # The period index of the date axis is computed once.
+    def close_by_period(self, ticker, period):
+        if not self._period_index.has_key(period):
+            self._period_index[period] = u.period_index(self.dates, period)
+        entry = self.tickers[ticker.lower()]
+        close = self.close[entry["row"], entry["start"]:entry["stop"]]
+        index = self._period_index[period][entry["start"]:entry["stop"]]
+        entries = ~np.isnan(close)
+        if len(entry["empty"]) > 0:
+            days = self.dates[entry["start"]:entry["stop"]].astype(np.int64)
+            entries |= np.in1d(days, entry["empty"])
+        return close[entries], index[entries]
+
+_open_stores = {}
+
+# Open the store in store_dir, or return None if it has not been built.
+# Stores are kept open for the life of the process and reopened if rebuilt.
+def open_store(store_dir = default_store_dir):
+    index_file = os.path.join(store_dir, "index.json")
+    if not os.path.exists(index_file):
+        return None
+    mtime = os.stat(index_file).st_mtime
+    if not _open_stores.has_key(store_dir) or _open_stores[store_dir][0] != mtime:
+        _open_stores[store_dir] = (mtime, PriceStore(store_dir))
+    return _open_stores[store_dir][1]
+
+
+# ********** Building the store **********
+
+# Ticker names of all stock files in src_dir, mapped to their paths.
+def find_stock_files(src_dir = default_src_dir):
+    files = {}
+    for path in glob.glob(os.path.join(src_dir, "*" + stock_file_suffix)):
+        files[os.path.basename(path)[:-len(stock_file_suffix)].lower()] = path
+    return files
+
+# Dates and closing prices of a stock file, sorted by date, keeping the last
+# entry of any repeated date.
+def read_stock_file(path):
+    import pandas as pd
+    stock = pd.read_csv(path, usecols = ["Date", "Close"])
+    close = pd.to_numeric(stock.Close, errors = "coerce").values
+    dates = pd.to_datetime(stock.Date, format = "%Y-%m-%d", errors = "coerce").values.astype("datetime64[D]")
+    keep = ~np.isnat(dates)
+    dates = dates[keep][::-1]
+    close = close[keep][::-1]
+    dates, first = np.unique(dates, return_index = True)
+    return dates, close[first]
+
+def _write_index(store_dir, dtype, tickers):
+    tmp_file = os.path.join(store_dir, "index.json.tmp")
+    with open(tmp_file, "w") as f:
+        json.dump({"dtype" : np.dtype(dtype).name, "tickers" : tickers}, f)
+    os.rename(tmp_file, os.path.join(store_dir, "index.json"))
+
+def _ticker_entry(path, row, axis, dates, empty):
+    stat = os.stat(path)
+    if len(dates) == 0:
+        start, stop = 0, 0
+    else:
+        start = int(np.searchsorted(axis, dates[0]))
+        stop = int(np.searchsorted(axis, dates[-1])) + 1
+    return {"row" : row, "start" : start, "stop" : stop, "empty" : empty, "size" : stat.st_size, \
+            "mtime" : stat.st_mtime}
+
+# Dates of the entries with an empty Close value, in days since 1970-01-01.
+def _empty_days(dates, close):
+    return [int(d) for d in dates[np.isnan(close)].astype(np.int64)]
+
+# Build the store from the stock files in src_dir, or bring an existing store up to date.
+# Returns the list of tickers that were parsed.
+def build_store(src_dir = default_src_dir, store_dir = default_store_dir, dtype = np.float64):
+    sources = find_stock_files(src_dir)
+    if not os.path.isdir(store_dir):
+        os.makedirs(store_dir)
+    old = open_store(store_dir)
+    if old is not None and old.dtype != np.dtype(dtype):
+        old = None
+    changed = sorted([t for t in sources.keys() if old is None or not old.is_current(t, sources[t])])
+    removed = [] if old is None else [t for t in old.tickers.keys() if not sources.has_key(t)]
+    if old is not None and len(changed) == 0 and len(removed) == 0:
+        return []
+
+    parsed = {}
+    for ticker in changed:
+        parsed[ticker] = read_stock_file(sources[ticker])
+    axis_parts = [dates for dates, close in parsed.values()]
+    if old is not None:
+        axis_parts.append(old.dates)
+    axis = np.unique(np.concatenate(axis_parts)) if axis_parts else np.zeros(0, dtype = "datetime64[D]")
+
+    if old is not None and len(removed) == 0 and np.array_equal(axis, old.dates) and \
+            all(old.tickers.has_key(t) for t in changed):
+        # Same tickers and date axis: overwrite the changed rows in place.
+        close = np.load(os.path.join(store_dir, "close.npy"), mmap_mode = "r+")
+        tickers = dict(old.tickers)
+        for ticker in changed:
+            dates, prices = parsed[ticker]
+            row = tickers[ticker]["row"]
+            close[row] = np.nan
+            close[row, np.searchsorted(axis, dates)] = prices
+            tickers[ticker] = _ticker_entry(sources[ticker], row, axis, dates, _empty_days(dates, prices))
+        close.flush()
+        del close
+        _write_index(store_dir, dtype, tickers)
+        return changed
+
+    # Otherwise write a new matrix, copying unchanged rows from the old store
+    # onto the new date axis.
+    names = sorted(sources.keys())
+    np.save(os.path.join(store_dir, "dates.npy.tmp.npy"), axis)
+    close_tmp = os.path.join(store_dir, "close.npy.tmp.npy")
+    close = np.lib.format.open_memmap(close_tmp, mode = "w+", dtype = dtype, shape = (len(names), len(axis)))
+    if old is not None:
+        old_positions = np.searchsorted(axis, old.dates)
+    tickers = {}
+    for row, ticker in enumerate(names):
+        close[row] = np.nan
+        if parsed.has_key(ticker):
+            dates, prices = parsed[ticker]
+            close[row, np.searchsorted(axis, dates)] = prices
+            empty = _empty_days(dates, prices)
+        else:
+            close[row, old_positions] = old.close[old.tickers[ticker]["row"]]
+            dates = old.dates[old.tickers[ticker]["start"]:old.tickers[ticker]["stop"]]
+            empty = old.tickers[ticker]["empty"]
+        tickers[ticker] = _ticker_entry(sources[ticker], row, axis, dates, empty)
+    close.flush()
+    del close
+    os.rename(os.path.join(store_dir, "dates.npy.tmp.npy"), os.path.join(store_dir, "dates.npy"))
+    os.rename(close_tmp, os.path.join(store_dir, "close.npy"))
+    _write_index(store_dir, dtype, tickers)
+    return changed
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Convert stock files into a memory-mapped price store.")
+    parser.add_argument("--src", default = default_src_dir, help = "Folder with <ticker>.us.txt files.")
+    parser.add_argument("--store", default = default_store_dir, help = "Folder to write the store to.")
+    parser.add_argument("--dtype", default = "float64", choices = ["float32", "float64"])
+    args = parser.parse_args()
+    changed = build_store(args.src, args.store, np.dtype(args.dtype))
+    print("Updated %d tickers in %s." % (len(changed), args.store))
+
+if __name__ == "__main__":
+    main()
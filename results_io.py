@@ -0,0 +1,250 @@
+# Compact binary format for correlation results.
+# A results folder holds compressed .npz chunks, one array per column, and a
+# manifest.json listing the columns, the chunks with per-chunk statistics and
+# any failures. Chunks are written as stocks finish, and the loader only reads the
+# columns and chunks that a query needs:
+#   writer = ResultsWriter("results/sweep")
+#   writer.write(df_chunk)
+#   df = read_results("results/sweep", columns = ["Name", "r"], filters = {"lag" : [1, 3, 6]})
+
+import json
+import os
+
+import numpy as np
+
+import instrument
+
+manifest_name = "manifest.json"
+# Distinct values of a text column are kept in the chunk statistics up to this number.
+max_distinct_values = 256
+
+
+def _column_dtype(values, float_dtype):
+    kind = values.dtype.kind
+    if kind == "f":
+        return np.dtype(float_dtype)
+    if kind in "iu":
+        return np.dtype(np.int64) if values.size and np.abs(values).max() >= 2 ** 31 else np.dtype(np.int32)
+    if kind == "b":
+        return np.dtype(np.bool_)
+    return None
+
+def _to_array(values, float_dtype):
+    values = np.asarray(values)
+    dtype = _column_dtype(values, float_dtype)
+    if dtype is None:
+        # Text columns are stored as fixed-width unicode, so no pickling is needed to load them.
+        return np.array([u"%s" % v for v in values], dtype = np.unicode_) if values.size else \
+                np.zeros(0, dtype = "U1")
+    return values.astype(dtype)
+
+def _chunk_stats(array):
+    if array.size == 0:
+        return None
+    if array.dtype.kind in "fiub":
+        if array.dtype.kind == "f":
+            if np.isnan(array).all():
+                return None
+            return {"min" : float(np.nanmin(array)), "max" : float(np.nanmax(array))}
+        return {"min" : int(array.min()), "max" : int(array.max())}
+    distinct = np.unique(array)
+    if len(distinct) <= max_distinct_values:
+        return {"values" : [u"%s" % v for v in distinct]}
+    return {"min" : u"%s" % distinct[0], "max" : u"%s" % distinct[-1]}
+
+
+# ********** Writing **********
+
+class ResultsWriter(object):
+    # Writes dataframes as chunks of a results folder. Floating point columns are
+    # stored as float_dtype (float32 by default, enough for correlations).
+    # With append, chunks are added to an existing folder, e.g. to resume a run.
+
+    def __init__(self, path, append = False, float_dtype = np.float32):
+        self.path = path
+        self.float_dtype = np.dtype(float_dtype)
+        if append and os.path.exists(os.path.join(path, manifest_name)):
+            self.manifest = read_manifest(path)
+        else:
+            if not os.path.isdir(path):
+                os.makedirs(path)
+            self.manifest = {"format" : 1, "columns" : None, "chunks" : [], "failures" : []}
+            self._save_manifest()
+
+    def _save_manifest(self):
+        tmp_file = os.path.join(self.path, manifest_name + ".tmp")
+        with open(tmp_file, "w") as f:
+            json.dump(self.manifest, f, indent = 1)
+        os.rename(tmp_file, os.path.join(self.path, manifest_name))
+
+    # Write a dataframe as a new chunk. All chunks must have the same columns.
+    def write(self, df):
+        if len(df) == 0:
+            return
+        columns = [str(c) for c in df.columns]
+        arrays = dict((str(c), _to_array(df[c].values, self.float_dtype)) for c in df.columns)
+        if self.manifest["columns"] is None:
+            self.manifest["columns"] = [[c, arrays[c].dtype.kind] for c in columns]
+        elif [c for c, kind in self.manifest["columns"]] != columns:
+            raise ValueError("Expecting columns %s, got %s." % ([c for c, k in self.manifest["columns"]], columns))
+        name = "part-%05d.npz" % len(self.manifest["chunks"])
+        # Write under a temporary name first, so a chunk is either complete or absent.
+        tmp_file = os.path.join(self.path, name + ".tmp.npz")
+        np.savez_compressed(tmp_file, **arrays)
+        os.rename(tmp_file, os.path.join(self.path, name))
+        self.manifest["chunks"].append({"file" : name, "rows" : len(df),
+                "stats" : dict((c, _chunk_stats(arrays[c])) for c in columns)})
+        self._save_manifest()
+
+    # Record failures (dictionaries with Name, error and reason) in the manifest.
+    def add_failures(self, failures):
+        if len(failures) > 0:
+            self.manifest["failures"].extend(failures)
+            self._save_manifest()
+
+    # Forget the failures recorded so far, e.g. to process those stocks again.
+    def clear_failures(self):
+        self.manifest["failures"] = []
+        self._save_manifest()
+
+    # Record the parameters the results are computed with (a dictionary of JSON values)
+    # in the manifest, or check that they are the ones already recorded, so that a
+    # folder is not resumed with other parameters.
+    def check_parameters(self, parameters):
+        recorded = self.manifest.get("parameters")
+        if recorded is None:
+            if len(self.manifest["chunks"]) > 0 or len(self.manifest["failures"]) > 0:
+                raise ValueError("Results in %s were written without parameters, cannot check %s." % \
+                        (self.path, parameters))
+            self.manifest["parameters"] = parameters
+            self._save_manifest()
+        elif recorded != json.loads(json.dumps(parameters)):
+            raise ValueError("Results in %s were computed with %s, got %s." % (self.path, recorded, parameters))
+
+class ChunkCollector(object):
+    # Collects the results of a batch run (see utils.run_batch, whose on_result and
+    # on_failure callbacks are add_result and add_failure) in chunks of chunk_size stocks.
+    # Each chunk of (stock, result) pairs is turned into a dataframe with make_frame, and
+    # written with writer, or kept in memory (see frame) when writer is None.
+    # Failures are recorded together with the results of the chunk they arrived in,
+    # so that the results folder always describes a consistent set of finished stocks.
+
+    def __init__(self, make_frame, columns, writer = None, chunk_size = 100):
+        self.make_frame = make_frame
+        self.columns = columns
+        self.writer = writer
+        self.chunk_size = chunk_size
+        self.frames = []
+        self.pending = []
+        self.failures = []
+        self.processed = 0
+        self.failed = 0
+
+    def add_result(self, stock, result):
+        self.pending.append((stock, result))
+        if len(self.pending) + len(self.failures) >= self.chunk_size:
+            self.flush()
+
+    def add_failure(self, failure):
+        self.failures.append(failure)
+        if len(self.pending) + len(self.failures) >= self.chunk_size:
+            self.flush()
+
+    # Write the stocks collected since the last chunk. Called once more after the run.
+    def flush(self):
+        if len(self.pending) > 0:
+            df = self.make_frame(self.pending)
+            with instrument.stage("write results", rows = len(df)):
+                if self.writer is None:
+                    self.frames.append(df)
+                else:
+                    self.writer.write(df)
+        if self.writer is not None:
+            self.writer.add_failures(self.failures)
+        self.processed += len(self.pending)
+        self.failed += len(self.failures)
+        del self.pending[:]
+        del self.failures[:]
+
+    # Results kept in memory, as one dataframe.
+    def frame(self):
+        import pandas as pd
+        if len(self.frames) == 0:
+            return pd.DataFrame(columns = self.columns)
+        return pd.concat(self.frames, ignore_index = True)
+
+
+# ********** Reading **********
+
+def read_manifest(path):
+    with open(os.path.join(path, manifest_name)) as f:
+        return json.load(f)
+
+def is_results_folder(path):
+    return os.path.exists(os.path.join(path, manifest_name))
+
+def _chunk_may_match(stats, filters):
+    for column, wanted in filters.items():
+        s = stats.get(column)
+        if s is None:
+            continue
+        if s.has_key("values"):
+            if not any(w in s["values"] for w in wanted):
+                return False
+        elif not any(s["min"] <= w <= s["max"] for w in wanted):
+            return False
+    return True
+
+# Load a results folder into a dataframe.
+# - columns: columns to load (all by default).
+# - filters: dictionary of column name to a value or list of values; only rows
+#   matching all filters are returned, and chunks that cannot match are not read.
+# Floating point columns are returned as float64.
+def read_results(path, columns = None, filters = None):
+    import pandas as pd
+    manifest = read_manifest(path)
+    all_columns = [c for c, kind in manifest["columns"] or []]
+    columns = all_columns if columns is None else list(columns)
+    missing = [c for c in columns if c not in all_columns]
+    if missing:
+        raise ValueError("Columns %s not found in %s." % (missing, path))
+    filters = dict((c, list(v) if isinstance(v, (list, tuple, set, np.ndarray)) else [v]) \
+            for c, v in (filters or {}).items())
+
+    frames = []
+    for chunk in manifest["chunks"]:
+        if not _chunk_may_match(chunk["stats"], filters):
+            continue
+        data = np.load(os.path.join(path, chunk["file"]))
+        try:
+            keep = np.ones(chunk["rows"], dtype = bool)
+            for column, wanted in filters.items():
+                values = data[column]
+                if values.dtype.kind == "U":
+                    wanted = [u"%s" % w for w in wanted]
+                keep &= np.in1d(values, wanted)
+            if not keep.any():
+                continue
+            frames.append(pd.DataFrame(dict((c, data[c][keep]) for c in columns), columns = columns))
+        finally:
+            data.close()
+    if len(frames) == 0:
+        return pd.DataFrame(columns = columns)
+    df = pd.concat(frames, ignore_index = True)
+    for c in columns:
+        if df[c].dtype.kind == "f":
+            df[c] = df[c].astype(np.float64)
+    return df
+
+# Failures recorded in a results folder, as a dataframe.
+def read_failures(path):
+    import pandas as pd
+    return pd.DataFrame(read_manifest(path)["failures"], columns = ["Name", "error", "reason"])
+
+# Convert a CSV results table (such as results/S&P_correlations_lag_1.csv) to a results folder.
+def convert_csv(csv_file, path, chunk_rows = 100000):
+    import pandas as pd
+    writer = ResultsWriter(path)
+    for chunk in pd.read_csv(csv_file, index_col = 0, chunksize = chunk_rows):
+        writer.write(chunk)
+    return path
@@ -0,0 +1,193 @@
+# Significance of stock / indicator correlations.
+# With ~84 monthly periods many correlations are noise, so for every stock and
+# indicator this adds:
+# - a permutation p-value: how often a correlation at least as strong (in absolute
+#   value) appears when the indicator is shifted in time. Shuffling single periods
+#   would destroy the autocorrelation of the series, and price levels are so
+#   autocorrelated that most unrelated pairs would then look significant.
+# - a moving block bootstrap confidence interval: periods are resampled in blocks
+#   of consecutive periods, which keeps the autocorrelation of both series.
+# Resamples are drawn once from a fixed seed and shared by all stocks, and each
+# batch of resamples is evaluated for a whole matrix of stocks with matrix products.
+# Memory is capped by max_bytes, by splitting resamples and stocks into chunks.
+
+import warnings
+
+import numpy as np
+
+import definitions as dfn
+import utils as u
+from aligned import as_aligned
+from correlation import center_rows, corr_from_sums, indicator_matrix, indicator_period, normalize_rows
+
+default_max_bytes = 256 * 1024 * 1024
+
+
+# ********** Resampling kernels **********
+
+# Circular shifts of range(n_periods), and the same read backwards, one per row, leaving
+# out the identity. There are 2 * n_periods - 1 of them: all are returned if n_permutations
+# is at least that, otherwise n_permutations of them drawn at random.
+def permutations(n_permutations, n_periods, seed = 0):
+    shifts = (np.arange(n_periods)[np.newaxis, :] + np.arange(n_periods)[:, np.newaxis]) % n_periods
+    index = np.vstack([shifts[1:], shifts[:, ::-1]])
+    if n_permutations >= len(index):
+        return index
+    rng = np.random.RandomState(seed)
+    return index[rng.choice(len(index), n_permutations, replace = False)]
+
+# Rows minus the line joining their first and last period. A random walk becomes a
+# Brownian bridge, whose circular shifts have the same distribution as itself, so the
+# shifts of permutations are a valid null for random walks as well as for stationary series.
+def remove_end_line(y):
+    y = np.atleast_2d(np.asarray(y, dtype = np.float64))
+    steps = np.arange(y.shape[1]) / max(1.0, y.shape[1] - 1.0)
+    return y - y[:, :1] - (y[:, -1:] - y[:, :1]) * steps
+
+# Number of times each period is drawn in each moving block bootstrap resample
+# (n_resamples x periods). Each resample is made of blocks of block_length
+# consecutive periods starting at random, cut to n_periods periods.
+def block_bootstrap_counts(n_resamples, n_periods, block_length, seed = 0):
+    rng = np.random.RandomState(seed)
+    block_length = max(1, min(block_length, n_periods))
+    n_blocks = -(-n_periods // block_length)
+    starts = rng.randint(0, n_periods - block_length + 1, size = (n_resamples, n_blocks))
+    index = (starts[:, :, np.newaxis] + np.arange(block_length)).reshape(n_resamples, -1)[:, :n_periods]
+    counts = np.zeros((n_resamples, n_periods))
+    rows = np.repeat(np.arange(n_resamples), n_periods)
+    np.add.at(counts, (rows, index.ravel()), 1)
+    return counts
+
+# Correlations of the rows of x (stocks x periods) with the rows of y (indicators x periods),
+# and their two-sided p-values. The test compares the correlation of each stock with the
+# indicator minus its end line (see remove_end_line) to its correlations with the circular
+# shifts of that series (see permutations), which keep its autocorrelation. The same shifts
+# are used for all stocks.
+def permutation_pvalues(x, y, n_permutations = 1000, seed = 0, max_bytes = default_max_bytes):
+    zx = normalize_rows(x)
+    r = np.dot(zx, normalize_rows(y).T)
+    zy = normalize_rows(remove_end_line(y))
+    r_test = np.dot(zx, zy.T)
+    exceed = np.zeros(r.shape)
+    n_periods = zx.shape[1]
+    perms = permutations(n_permutations, n_periods, seed)
+    n_permutations = len(perms)
+    # Each permutation takes indicators x periods for the permuted indicators and
+    # stocks x indicators for the correlations.
+    chunk = max(1, int(max_bytes // (8 * zy.shape[0] * (n_periods + zx.shape[0]))))
+    for i in range(0, n_permutations, chunk):
+        p = perms[i:i + chunk]
+        permuted = zy[:, p].reshape(-1, n_periods)
+        r_perm = np.dot(zx, permuted.T).reshape(zx.shape[0], zy.shape[0], len(p))
+        # Small tolerance so that ties with the observed correlation are counted.
+        # Rows with missing periods are NaN, and get a NaN p-value below.
+        with np.errstate(invalid = "ignore"):
+            exceed += (np.abs(r_perm) >= np.abs(r_test)[:, :, np.newaxis] - 1e-12).sum(axis = 2)
+    p_values = (exceed + 1) / (n_permutations + 1)
+    p_values[np.isnan(r) | np.isnan(r_test)] = np.nan
+    return r, p_values
+
+# Moving block bootstrap confidence intervals of the correlations of the rows of x
+# with the rows of y. Returns the lower and upper bounds (stocks x indicators).
+def bootstrap_intervals(x, y, n_resamples = 1000, block_length = 6, confidence = 0.95, seed = 0, \
+        max_bytes = default_max_bytes):
+    x = np.asarray(x, dtype = np.float64)
+    y = np.asarray(y, dtype = np.float64)
+    x = center_rows(x)
+    y = center_rows(y)
+    n_stocks, n_periods = x.shape
+    counts = block_bootstrap_counts(n_resamples, n_periods, block_length, seed)
+    n = float(n_periods)
+    # Weighted sums for every resample, using how often each period was drawn.
+    sum_x = np.dot(x, counts.T)
+    sum_xx = np.dot(x * x, counts.T)
+    sum_y = np.dot(y, counts.T)
+    sum_yy = np.dot(y * y, counts.T)
+    r_boot = np.empty((n_stocks, y.shape[0], n_resamples), dtype = np.float32)
+    chunk = max(1, int(max_bytes // (8 * n_stocks * (n_periods + y.shape[0]))))
+    for i in range(0, n_resamples, chunk):
+        c = counts[i:i + chunk]
+        weighted = (x[:, np.newaxis, :] * c[np.newaxis, :, :]).reshape(-1, n_periods)
+        sum_xy = np.dot(weighted, y.T).reshape(n_stocks, len(c), y.shape[0]).transpose(0, 2, 1)
+        r_boot[:, :, i:i + chunk] = corr_from_sums(n, sum_x[:, np.newaxis, i:i + chunk], \
+                sum_y[np.newaxis, :, i:i + chunk], sum_xx[:, np.newaxis, i:i + chunk], \
+                sum_yy[np.newaxis, :, i:i + chunk], sum_xy)
+    alpha = 100 * (1 - confidence) / 2
+    with warnings.catch_warnings():
+        # Stocks with missing periods only have NaN resamples.
+        warnings.simplefilter("ignore", RuntimeWarning)
+        low, high = np.nanpercentile(r_boot, [alpha, 100 - alpha], axis = 2)
+    return low, high
+
+
+# ********** Significance for stocks and indicators **********
+
+# Significance of the correlations of a list of stocks with every indicator, for a lag in
+# months and diff setting as in corr_indicators. block_length is in months, and is divided
+# by 3 for quarterly indicators. Work is split into chunks of stocks spread across a pool
+# of n_workers processes, each sized so that its resamples fit in max_bytes.
+# Returns a long dataframe with Name, indicator, r, p_value, ci_low and ci_high,
+# and a dataframe of failures.
+def significance_for_stocks(stocks, indicator_data, lag, diff = False, n_permutations = 1000, \
+        n_bootstrap = 1000, block_length = 6, confidence = 0.95, seed = 0, \
+        max_bytes = default_max_bytes, n_workers = None):
+    import multiprocessing
+    import pandas as pd
+    if n_workers is None:
+        n_workers = multiprocessing.cpu_count()
+    n_indicators = max(1, len(indicator_data))
+    chunk = max(1, int(max_bytes // (4 * n_indicators * max(n_permutations, n_bootstrap))))
+    chunk = min(chunk, max(1, -(-len(stocks) // max(1, n_workers))))
+    stock_chunks = [tuple(stocks[i:i + chunk]) for i in range(0, len(stocks), chunk)]
+    settings = {"n_permutations" : n_permutations, "n_bootstrap" : n_bootstrap, \
+            "block_length" : block_length, "confidence" : confidence, "seed" : seed, "max_bytes" : max_bytes}
+    results, chunk_failures = u.run_batch(significance_chunk, stock_chunks, \
+            (as_aligned(indicator_data), lag, diff, settings), n_workers, chunksize = 1, \
+            label = "chunks of stocks", item = "stocks %s")
+    rows = [row for chunk_rows, chunk_fails in results for row in chunk_rows]
+    failures = [f for chunk_rows, chunk_fails in results for f in chunk_fails]
+    for f in chunk_failures:
+        failures.extend({"Name" : st, "error" : f["error"], "reason" : f["reason"]} for st in f["Name"])
+    return pd.DataFrame(rows, columns = ["Name", "indicator", "r", "p_value", "ci_low", "ci_high"]), \
+            pd.DataFrame(failures, columns = ["Name", "error", "reason"])
+
+def significance_sp_500(indicator_data, lag, diff = False, **kwargs):
+    import indicator_correlation as ind
+    return significance_for_stocks(ind.get_sp_500_stocks(), indicator_data, lag, diff, **kwargs)
+
+# Significance for one chunk of stocks, run in a worker process.
+def significance_chunk(stocks, indicator_data, lag, diff, settings):
+    import indicator_correlation as ind
+    names = []
+    series = {"month" : [], "quarter" : []}
+    failures = []
+    for stock in stocks:
+        try:
+            monthly, quarterly = ind.get_stock_data_for_correlation(stock, lag, diff)
+        except Exception as e:
+            failures.append({"Name" : stock, "error" : type(e).__name__, "reason" : str(e)})
+            continue
+        names.append(stock)
+        series["month"].append(monthly)
+        series["quarter"].append(quarterly)
+    if len(names) == 0:
+        return [], failures
+
+    indicators = sorted(indicator_data.keys())
+    rows = []
+    for period in ["month", "quarter"]:
+        period_indicators = [i for i in indicators if indicator_period(i) == period]
+        if len(period_indicators) == 0:
+            continue
+        x = np.array(series[period], dtype = np.float64)
+        y = indicator_matrix(indicator_data, indicators, period)
+        block_length = settings["block_length"] if period == "month" else max(1, settings["block_length"] // 3)
+        r, p_values = permutation_pvalues(x, y, settings["n_permutations"], settings["seed"], \
+                settings["max_bytes"])
+        low, high = bootstrap_intervals(x, y, settings["n_bootstrap"], block_length, settings["confidence"], \
+                settings["seed"], settings["max_bytes"])
+        for s, name in enumerate(names):
+            for i, indicator in enumerate(period_indicators):
+                rows.append({"Name" : name, "indicator" : dfn.indicators[indicator]["df column"], \
+                        "r" : r[s, i], "p_value" : p_values[s, i], "ci_low" : low[s, i], "ci_high" : high[s, i]})
+    return rows, failures
@@ -0,0 +1,104 @@
+# Seeded generator of synthetic data in the layout described in data/readme.txt,
+# for benchmarks and for trying the pipeline without the Kaggle dataset:
+# - data/stocks/<ticker>.us.txt with Date,Open,High,Low,Close,Volume,OpenInt columns,
+#   random walk prices on business days, with missing days, missing Close values and
+#   stocks that start trading late.
+# - data/indicators/<file> for every indicator in definitions file, in the FRED
+#   layout (DATE and the raw column, with "." for missing values).
+# - data/S&P_stocks.csv listing the tickers.
+#   python synthetic.py --out /tmp/synthetic --tickers 500 --years 10
+
+import argparse
+import os
+
+import numpy as np
+
+import definitions as dfn
+
+
+def _business_days(start_year, end_year):
+    days = np.arange(np.datetime64("%d-01-01" % start_year), np.datetime64("%d-01-01" % (end_year + 1)))
+    # 1970-01-01 was a Thursday.
+    weekday = (days.astype(np.int64) + 3) % 7
+    return days[weekday < 5]
+
+def _random_walk(rng, n, start, volatility):
+    return start * np.exp(np.cumsum(rng.randn(n) * volatility))
+
+# Lower case, like the file names of the Kaggle dataset, so that stock files are
+# found on case-sensitive file systems.
+def _ticker_names(n_tickers):
+    return ["s%05d" % i for i in range(n_tickers)]
+
+# Write n_tickers stock files to out_dir/data/stocks and list them in out_dir/data/S&P_stocks.csv.
+# - gap_rate: fraction of business days without a row.
+# - nan_rate: fraction of rows with an empty Close value.
+# - late_start_rate: fraction of stocks that start trading at a random date.
+def write_stock_files(out_dir, n_tickers, start_year, end_year, seed = 0, gap_rate = 0.02, \
+        nan_rate = 0.001, late_start_rate = 0.05):
+    rng = np.random.RandomState(seed)
+    stocks_dir = os.path.join(out_dir, "data", "stocks")
+    if not os.path.isdir(stocks_dir):
+        os.makedirs(stocks_dir)
+    all_days = _business_days(start_year, end_year)
+    names = _ticker_names(n_tickers)
+    for name in names:
+        days = all_days[rng.rand(len(all_days)) >= gap_rate]
+        if rng.rand() < late_start_rate:
+            days = days[rng.randint(len(days)):]
+        close = _random_walk(rng, len(days), rng.uniform(5, 500), rng.uniform(0.005, 0.04))
+        close_text = np.char.mod("%.4f", close)
+        close_text[rng.rand(len(days)) < nan_rate] = ""
+        volume = rng.randint(1000, 10000000, size = len(days))
+        with open(os.path.join(stocks_dir, name + ".us.txt"), "w") as f:
+            f.write("Date,Open,High,Low,Close,Volume,OpenInt\n")
+            for day, c, v in zip(days.astype(str), close_text, volume):
+                f.write("%s,%s,%s,%s,%s,%d,0\n" % (day, c, c, c, c, v))
+    with open(os.path.join(out_dir, "data", "S&P_stocks.csv"), "w") as f:
+        f.write(",Name\n")
+        for i, name in enumerate(names):
+            f.write("%d,%s\n" % (i, name))
+    return names
+
+# Write a file for every indicator in definitions file to out_dir/data/indicators,
+# at the time resolution of the indicator.
+def write_indicator_files(out_dir, start_year, end_year, seed = 0, missing_rate = 0.01):
+    rng = np.random.RandomState(seed)
+    indicators_dir = os.path.join(out_dir, "data", "indicators")
+    if not os.path.isdir(indicators_dir):
+        os.makedirs(indicators_dir)
+    months = np.arange(np.datetime64("%d-01" % start_year), np.datetime64("%d-01" % (end_year + 1)))
+    for indicator in sorted(dfn.indicators.keys()):
+        indicator_dict = dfn.indicators[indicator]
+        if indicator_dict["time"] == "day":
+            dates = _business_days(start_year, end_year)
+        elif indicator_dict["time"] == "month":
+            dates = months.astype("datetime64[D]")
+        else:
+            dates = months[::3].astype("datetime64[D]")
+        values = np.char.mod("%.3f", _random_walk(rng, len(dates), rng.uniform(1, 1000), 0.01))
+        values[rng.rand(len(dates)) < missing_rate] = "."
+        with open(os.path.join(indicators_dir, indicator_dict["file"]), "w") as f:
+            f.write("DATE,%s\n" % indicator_dict["raw column"])
+            for day, value in zip(dates.astype(str), values):
+                f.write("%s,%s\n" % (day, value))
+
+# Write a complete synthetic data folder covering the years [end_year - n_years + 1, end_year].
+def generate(out_dir, n_tickers, n_years, end_year = 2017, seed = 0):
+    start_year = end_year - n_years + 1
+    write_indicator_files(out_dir, start_year, end_year, seed)
+    return write_stock_files(out_dir, n_tickers, start_year, end_year, seed + 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Write synthetic stock and indicator files.")
+    parser.add_argument("--out", required = True, help = "Folder to create the data folder in.")
+    parser.add_argument("--tickers", type = int, default = 500)
+    parser.add_argument("--years", type = int, default = 10)
+    parser.add_argument("--end-year", type = int, default = 2017)
+    parser.add_argument("--seed", type = int, default = 0)
+    args = parser.parse_args()
+    generate(args.out, args.tickers, args.years, args.end_year, args.seed)
+
+if __name__ == "__main__":
+    main()
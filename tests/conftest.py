@@ -0,0 +1,26 @@
+# The analysis modules are top-level modules of the repository.
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+# Write synthetic stock files for n_tickers tickers from start_year to end_year in a
+# temporary folder, which becomes the working directory, and return the tickers.
+# With indicators, indicator files are written as well, as in synthetic.generate (stock
+# files then use seed + 1). Other options are passed on to synthetic.write_stock_files.
+@pytest.fixture
+def synthetic_stocks(tmpdir, monkeypatch):
+    import synthetic
+
+    def write(n_tickers, start_year, end_year, indicators = True, seed = 0, **options):
+        out = str(tmpdir)
+        if indicators:
+            synthetic.write_indicator_files(out, start_year, end_year, seed)
+            seed = seed + 1
+        names = synthetic.write_stock_files(out, n_tickers, start_year, end_year, seed, **options)
+        monkeypatch.chdir(out)
+        return names
+    return write
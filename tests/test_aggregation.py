@@ -0,0 +1,89 @@
+# Calendar aggregation of utils.py against the per-row bucketing it replaced.
+
+import os
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import definitions as dfn
+import utils as u
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# Mean of the non-NaN values of each month (or quarter) of the range, bucketed one
+# row at a time. Raises the ValueError of mean_year_month for a period without rows.
+def _per_row_means(data_col, date_col, period, start_year, start_period, end_year, end_period):
+    months_per_period = 12 // u.periods_per_year[period]
+    buckets = {}
+    for date, value in zip(date_col, data_col):
+        values = buckets.setdefault((date.year, (date.month - 1) // months_per_period + 1), [])
+        if not np.isnan(value):
+            values.append(value)
+    output = []
+    for y in range(start_year, end_year + 1):
+        first = start_period if y == start_year else 1
+        last = end_period if y == end_year else u.periods_per_year[period]
+        for p in range(first, last + 1):
+            if (y, p) not in buckets:
+                raise ValueError("No data for year %s, %s %s." % (y, period, p))
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", RuntimeWarning)
+                output.append(np.mean(buckets[(y, p)]) if buckets[(y, p)] else np.nan)
+    return output
+
+def _random_series(seed):
+    rng = np.random.RandomState(seed)
+    dates = pd.Series(pd.to_datetime("2009-11-01") + pd.to_timedelta(rng.randint(0, 800, 3000), unit = "D"))
+    data = pd.Series(rng.randn(3000))
+    data[rng.rand(3000) < 0.2] = np.nan
+    return data, dates
+
+@pytest.mark.parametrize("period, n_periods", [("month", 12), ("quarter", 4)])
+def test_random_series_match_per_row_means(period, n_periods):
+    data, dates = _random_series(0)
+    # All values of one month are NaN: its mean is NaN, not missing.
+    data[(dates.dt.year == 2010) & (dates.dt.month == 6)] = np.nan
+    aggregate = u.mean_year_month if period == "month" else u.mean_year_quarter
+    got = aggregate(data, dates, 2010, 2, 2011, n_periods - 1)
+    expected = _per_row_means(data, dates, period, 2010, 2, 2011, n_periods - 1)
+    np.testing.assert_allclose(got, expected, rtol = 1e-12, equal_nan = True)
+    if period == "month":
+        assert np.isnan(got[4])
+
+def test_missing_period_message():
+    data, dates = _random_series(1)
+    keep = ~((dates.dt.year == 2010) & (dates.dt.month.isin([4, 5, 6])))
+    data, dates = data[keep].reset_index(drop = True), dates[keep].reset_index(drop = True)
+    for aggregate, period, message in [(u.mean_year_month, "month", "No data for year 2010, month 4."), \
+            (u.mean_year_quarter, "quarter", "No data for year 2010, quarter 2.")]:
+        with pytest.raises(ValueError) as error:
+            aggregate(data, dates, 2010, 1, 2010, 12 if period == "month" else 4)
+        assert str(error.value) == message
+        with pytest.raises(ValueError) as error:
+            _per_row_means(data, dates, period, 2010, 1, 2010, 12 if period == "month" else 4)
+        assert str(error.value) == message
+    means = u.mean_by_period(data, dates, "month", 2010, 1, 2010, 12, allow_missing = True)
+    assert np.isnan(means[3:6]).all() and not np.isnan(means[:3]).any()
+
+@pytest.mark.parametrize("indicator", sorted(dfn.indicators.keys()))
+def test_indicator_files_match_per_row_means(indicator):
+    definition = dfn.indicators[indicator]
+    # definitions file and the data folder do not always agree on the case of file names.
+    folder = os.path.join(root, "data", "indicators")
+    name = [f for f in os.listdir(folder) if f.lower() == definition["file"].lower()][0]
+    df = pd.read_csv(os.path.join(folder, name))
+    data = pd.to_numeric(df[definition["raw column"]], errors = "coerce")
+    dates = pd.to_datetime(df["DATE"])
+    for period, n_periods in [("month", 12), ("quarter", 4)]:
+        try:
+            expected = _per_row_means(data, dates, period, dfn.start_year, 1, dfn.end_year, n_periods)
+        except ValueError as e:
+            with pytest.raises(ValueError) as error:
+                u.mean_by_period(data, dates, period, dfn.start_year, 1, dfn.end_year, n_periods)
+            assert str(error.value) == str(e)
+            continue
+        got = u.mean_by_period(data, dates, period, dfn.start_year, 1, dfn.end_year, n_periods)
+        np.testing.assert_allclose(got, expected, rtol = 1e-12, equal_nan = True)
@@ -0,0 +1,19 @@
+# Batch engine of utils.py, run in the calling process.
+
+import utils as u
+
+
+def _inverse(x):
+    return 1.0 / x
+
+def test_results_in_order_and_failures_collected():
+    rows, failures = u.run_batch(_inverse, [1, 0, 4], n_workers = 1)
+    assert rows == [1.0, 0.25]
+    assert [(f["Name"], f["error"]) for f in failures] == [(0, "ZeroDivisionError")]
+
+def test_failures_are_logged_with_the_task_name(caplog):
+    u.run_batch(_inverse, [0], n_workers = 1)
+    u.run_batch(_inverse, [0], n_workers = 1, label = "cluster numbers", item = "Kmeans with %s clusters")
+    messages = [r.getMessage() for r in caplog.records if r.name == "stocks"]
+    assert messages[0].startswith("Processing of stock 0 failed")
+    assert messages[1].startswith("Processing of Kmeans with 0 clusters failed")
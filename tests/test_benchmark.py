@@ -0,0 +1,21 @@
+# The benchmark suite on a small synthetic dataset.
+
+import copy
+
+import benchmark
+import definitions as dfn
+
+
+def test_suite_runs_every_stage_and_restores_the_years(tmpdir):
+    years = dfn.start_year, dfn.end_year
+    results = benchmark.run_suite(12, 5, data_dir = str(tmpdir))
+    assert (dfn.start_year, dfn.end_year) == years
+    assert benchmark.failed_stages(results) == []
+    kmeans = [s for s in results["stages"] if s["name"].startswith("run_kmeans")]
+    assert len(kmeans) == 2 and all(s["info"]["rows"] > 0 for s in kmeans)
+
+    assert benchmark.compare_results(results, results) == []
+    failed = copy.deepcopy(results)
+    failed["stages"][-1]["error"] = "ValueError: no rows"
+    assert benchmark.failed_stages(failed) == [results["stages"][-1]["name"]]
+    assert benchmark.compare_results(failed, results) == [results["stages"][-1]["name"]]
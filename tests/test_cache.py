@@ -0,0 +1,52 @@
+# On-disk cache: invalidation, eviction and unreadable entries.
+
+import os
+
+import numpy as np
+
+import cache
+
+
+def _cached_sum(path, cache_dir, calls):
+    def compute():
+        calls.append(path)
+        with open(path) as f:
+            return np.array([float(x) for x in f.read().split()])
+    return cache.cached_array(["sum", cache.file_hash(path)], compute, cache_dir)
+
+def test_changed_source_file_is_computed_again(tmpdir):
+    cache_dir = str(tmpdir.join("cache"))
+    path = str(tmpdir.join("values.txt"))
+    calls = []
+    tmpdir.join("values.txt").write("1 2 3")
+    np.testing.assert_array_equal(_cached_sum(path, cache_dir, calls), [1, 2, 3])
+    np.testing.assert_array_equal(_cached_sum(path, cache_dir, calls), [1, 2, 3])
+    assert len(calls) == 1
+    tmpdir.join("values.txt").write("1 2 3 4")
+    # Make sure the change is visible even on file systems with coarse timestamps.
+    os.utime(path, (os.stat(path).st_atime, os.stat(path).st_mtime + 10))
+    np.testing.assert_array_equal(_cached_sum(path, cache_dir, calls), [1, 2, 3, 4])
+    assert len(calls) == 2
+
+def test_least_recently_used_entries_are_evicted(tmpdir):
+    cache_dir = str(tmpdir)
+    value = np.zeros(1000)
+    for i in range(3):
+        cache.cached_array(["entry", i], lambda: value, cache_dir)
+        path = os.path.join(cache_dir, cache.cache_key(["entry", i]) + ".npy")
+        entry_bytes = os.path.getsize(path)
+        os.utime(path, (1000000 + i, 1000000 + i))
+    # Reading entry 0 makes entry 1 the least recently used.
+    cache.cached_array(["entry", 0], lambda: None, cache_dir)
+    cache.evict(cache_dir, 2 * entry_bytes)
+    names = set(os.listdir(cache_dir))
+    assert names == set(cache.cache_key(["entry", i]) + ".npy" for i in [0, 2])
+    cache.clear(cache_dir)
+    assert os.listdir(cache_dir) == []
+
+def test_unreadable_entry_is_computed_again(tmpdir):
+    cache_dir = str(tmpdir)
+    tmpdir.join(cache.cache_key(["entry"]) + ".npy").write("not an array")
+    value = cache.cached_array(["entry"], lambda: np.arange(3), cache_dir)
+    np.testing.assert_array_equal(value, np.arange(3))
+    np.testing.assert_array_equal(cache.cached_array(["entry"], lambda: None, cache_dir), np.arange(3))
@@ -0,0 +1,66 @@
+# Kmeans cluster search on well-separated synthetic clusters.
+
+import numpy as np
+import pytest
+
+import clustering_analysis as cl
+
+
+def _blobs(seed, n_clusters = 4, n_rows = 400, n_features = 5):
+    rng = np.random.RandomState(seed)
+    centers = 10 * rng.randn(n_clusters, n_features)
+    labels = rng.randint(0, n_clusters, n_rows)
+    return centers[labels] + rng.randn(n_rows, n_features), labels
+
+def _same_partition(a, b):
+    # Labels may be numbered differently, but must pair one to one.
+    pairs = set(zip(a, b))
+    return len(pairs) == len(set(a)) == len(set(b))
+
+def test_pool_matches_serial_search():
+    data, labels = _blobs(0)
+    serial = cl.search_n_clusters(data, 6, n_workers = 1)
+    pool = cl.search_n_clusters(data, 6, n_workers = 2)
+    assert serial.n_clusters == pool.n_clusters == [2, 3, 4, 5, 6]
+    np.testing.assert_allclose(pool.inertia, serial.inertia)
+    np.testing.assert_allclose(pool.silhouette, serial.silhouette)
+    for k, model in zip(pool.n_clusters, pool.models):
+        np.testing.assert_allclose(model.inertia_, cl.run_kmeans(data, k).inertia_)
+    assert pool.n_clusters[int(np.argmax(pool.silhouette))] == 4
+    assert _same_partition(pool.models[2].labels_, labels)
+
+def test_warm_start_finds_the_clusters():
+    data, labels = _blobs(1)
+    full = cl.search_n_clusters(data, 6, n_workers = 1)
+    warm = cl.search_n_clusters(data, 6, warm_start = True)
+    assert [m.n_clusters for m in warm.models] == warm.n_clusters
+    assert np.all(np.diff(warm.inertia) < 0)
+    assert warm.n_clusters[int(np.argmax(warm.silhouette))] == 4
+    assert _same_partition(warm.models[2].labels_, labels)
+    np.testing.assert_allclose(warm.inertia[2], full.inertia[2], rtol = 1e-6)
+
+def test_failed_fit_raises():
+    data, labels = _blobs(2, n_rows = 5)
+    with pytest.raises(ValueError):
+        cl.search_n_clusters(data, 6, n_workers = 1)
+
+def test_streaming_chunks_match_partial_fit():
+    data, labels = _blobs(3, n_rows = 2000)
+    chunks = list(cl.iter_chunks(data, 256))
+    by_chunk = cl.StreamingKMeans(4, 256)
+    for chunk in chunks:
+        by_chunk.partial_fit(chunk)
+    streamed = cl.StreamingKMeans(4, 256).fit_chunks(iter(chunks))
+    np.testing.assert_array_equal(streamed.cluster_centers_, by_chunk.cluster_centers_)
+    assert streamed.cluster_centers_.shape == (4, 5)
+
+def test_streaming_predict_assigns_new_rows():
+    data, labels = _blobs(4, n_rows = 2000)
+    model = cl.StreamingKMeans(4, 256).fit(data[:1500], n_epochs = 3)
+    assert _same_partition(model.model.labels_, labels[:1500])
+    # Rows not seen during the fit get the cluster of their nearest centroid.
+    predicted = model.predict(data[1500:], chunk_rows = 128)
+    distances = cl.centroid_distances(data[1500:], model.cluster_centers_.astype(np.float64))
+    np.testing.assert_array_equal(predicted, distances.argmin(axis = 1))
+    assert _same_partition(np.concatenate([model.model.labels_, predicted]), labels)
+    assert len(model.predict(data[:0])) == 0
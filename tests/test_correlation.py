@@ -0,0 +1,69 @@
+# Batched correlation kernels against one np.corrcoef call per pair, on random
+# data with missing (NaN) periods.
+
+import numpy as np
+
+import correlation as corr
+import definitions as dfn
+
+
+def _random_rows(rng, n_rows, n_periods, nan_rate):
+    rows = rng.randn(n_rows, n_periods).cumsum(axis = 1)
+    rows[rng.rand(n_rows, n_periods) < nan_rate] = np.nan
+    return rows
+
+# Correlation of every pair of rows with np.corrcoef, which gives NaN when either row has NaN.
+def _corrcoef_pairs(x, y):
+    return np.array([[np.corrcoef(a, b)[0][1] for b in y] for a in x])
+
+# Indicator data for every indicator of definitions file, with gaps in some indicators.
+def _indicator_data(rng, nan_rate = 0.05):
+    data = {}
+    for ind in sorted(dfn.indicators.keys()):
+        n = (dfn.end_year - dfn.start_year + 1) * (4 if corr.indicator_period(ind) == "quarter" else 12)
+        data[ind] = _random_rows(rng, 1, n, nan_rate)[0]
+    return data
+
+
+def test_corr_matrix_propagates_nan():
+    rng = np.random.RandomState(0)
+    x = _random_rows(rng, 20, 40, 0.02)
+    y = _random_rows(rng, 5, 40, 0.02)
+    r = corr.corr_matrix(x, y)
+    np.testing.assert_allclose(r, _corrcoef_pairs(x, y), atol = 1e-12, equal_nan = True)
+    assert np.isnan(r).any() and not np.isnan(r).all()
+
+def test_masked_corr_matrix_uses_shared_periods():
+    rng = np.random.RandomState(1)
+    x = _random_rows(rng, 20, 50, 0.2)
+    y = _random_rows(rng, 5, 50, 0.2)
+    expected = np.empty((len(x), len(y)))
+    for i in range(len(x)):
+        for j in range(len(y)):
+            valid = ~np.isnan(x[i]) & ~np.isnan(y[j])
+            expected[i, j] = np.corrcoef(x[i][valid], y[j][valid])[0][1]
+    np.testing.assert_allclose(corr.masked_corr_matrix(x, y), expected, atol = 1e-12, equal_nan = True)
+
+def test_corr_with_indicators_matches_corrcoef_with_gaps():
+    rng = np.random.RandomState(2)
+    indicator_data = _indicator_data(rng)
+    n_years = dfn.end_year - dfn.start_year + 1
+    monthly = _random_rows(rng, 30, 12 * n_years, 0.01)
+    quarterly = _random_rows(rng, 30, 4 * n_years, 0.01)
+    r, indicators = corr.corr_with_indicators(monthly, quarterly, indicator_data)
+    for i, ind in enumerate(indicators):
+        stock_data = quarterly if corr.indicator_period(ind) == "quarter" else monthly
+        np.testing.assert_allclose(r[:, i], _corrcoef_pairs(stock_data, [indicator_data[ind]])[:, 0], \
+                atol = 1e-12, equal_nan = True)
+
+def test_kernels_agree_on_missing_periods():
+    # A single full window of the rolling kernel and the zero shift of the lead-lag
+    # kernel are the plain correlation, with the same NaN pairs.
+    rng = np.random.RandomState(3)
+    x = _random_rows(rng, 15, 36, 0.03)
+    y = _random_rows(rng, 4, 36, 0.03)
+    r = corr.corr_matrix(x, y)
+    rolling, ends = corr.rolling_corr_matrix(x, y, window = x.shape[1])
+    np.testing.assert_allclose(rolling[:, :, 0], r, atol = 1e-10, equal_nan = True)
+    shifted = corr.shifted_corr_matrix(x, y)
+    np.testing.assert_allclose(shifted[:, :, 0], r, atol = 1e-10, equal_nan = True)
@@ -0,0 +1,61 @@
+# DateIndex range queries against brute-force scans of the series.
+
+import numpy as np
+import pandas as pd
+
+import utils as u
+
+
+def _series(seed, n = 500):
+    rng = np.random.RandomState(seed)
+    dates = pd.Series(pd.to_datetime("2010-01-01") + pd.to_timedelta(rng.randint(0, 400, n), unit = "D"))
+    dates[rng.rand(n) < 0.05] = pd.NaT
+    data = pd.Series(rng.randn(n))
+    data[rng.rand(n) < 0.1] = np.nan
+    return data, dates
+
+def _in_range(dates, start, end):
+    return ((dates >= start) & (dates <= end)).values
+
+def test_positions_of_unsorted_dates():
+    data, dates = _series(0)
+    index = u.DateIndex(dates)
+    assert len(index) == dates.notnull().sum()
+    start, end = pd.Timestamp("2010-03-05"), pd.Timestamp("2010-06-30")
+    np.testing.assert_array_equal(index.positions(start, end), np.flatnonzero(_in_range(dates, start, end)))
+    np.testing.assert_array_equal(u.find_dates_in_range(dates, start, end)[0], \
+            np.flatnonzero(_in_range(dates, start, end)))
+
+def test_means_match_brute_force():
+    data, dates = _series(1)
+    index = u.DateIndex(dates, data)
+    rng = np.random.RandomState(2)
+    starts = pd.to_datetime("2009-12-01") + pd.to_timedelta(rng.randint(0, 420, 200), unit = "D")
+    ends = starts + pd.to_timedelta(rng.randint(-5, 60, 200), unit = "D")
+    means = index.means(starts.values, ends.values)
+    for start, end, got in zip(starts, ends, means):
+        values = data[_in_range(dates, start, end)].dropna()
+        if len(values) == 0:
+            assert np.isnan(got)
+        else:
+            np.testing.assert_allclose(got, values.mean(), rtol = 1e-10)
+
+def test_empty_ranges():
+    data, dates = _series(3)
+    index = u.DateIndex(dates, data)
+    # Before the first date, and with the end before the start.
+    assert len(index.positions(pd.Timestamp("2000-01-01"), pd.Timestamp("2000-02-01"))) == 0
+    assert len(index.values_in_range(pd.Timestamp("2010-05-01"), pd.Timestamp("2010-04-01"))) == 0
+    assert np.isnan(index.mean(pd.Timestamp("2010-05-01"), pd.Timestamp("2010-04-01")))
+    try:
+        u.mean_in_date_range(data, dates, pd.Timestamp("2000-01-01"), pd.Timestamp("2000-02-01"))
+    except ValueError as e:
+        assert str(e) == "No dates found in range"
+    else:
+        assert False
+
+def test_mean_in_date_range_skips_nan():
+    data, dates = _series(4)
+    start, end = pd.Timestamp("2010-02-01"), pd.Timestamp("2010-02-28")
+    np.testing.assert_allclose(u.mean_in_date_range(data, dates, start, end), \
+            data[_in_range(dates, start, end)].dropna().mean())
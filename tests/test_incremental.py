@@ -0,0 +1,52 @@
+# Incremental correlations against sweep_lags on synthetic stock files, with
+# indicators that have missing periods.
+
+import os
+
+import numpy as np
+
+import definitions as dfn
+import incremental
+import indicator_correlation as ind
+from correlation import indicator_period
+
+
+def _indicator_data(rng):
+    # Random walks, with a few missing periods in every other indicator.
+    data = {}
+    for i, indicator in enumerate(sorted(dfn.indicators.keys())):
+        n = (dfn.end_year - dfn.start_year + 1) * (4 if indicator_period(indicator) == "quarter" else 12)
+        series = rng.randn(n).cumsum()
+        if i % 2 == 0:
+            series[rng.choice(n, 2, replace = False)] = np.nan
+        data[indicator] = series
+    return data
+
+def test_incremental_matches_sweep_lags_with_indicator_gaps(synthetic_stocks, tmpdir):
+    out = str(tmpdir)
+    stocks = synthetic_stocks(3, dfn.start_year - 1, dfn.end_year + 2, indicators = False, seed = 1, \
+            late_start_rate = 0)
+    indicator_data = _indicator_data(np.random.RandomState(0))
+    lags = range(0, 4)
+
+    inc = incremental.IncrementalCorrelations(indicator_data, lags = lags)
+    for stock in stocks:
+        # Read in two parts, to go through the updates of periods already added.
+        path = os.path.join("data", "stocks", stock + ".us.txt")
+        with open(path) as f:
+            lines = f.readlines()
+        partial = os.path.join(out, "partial.txt")
+        with open(partial, "w") as f:
+            f.writelines(lines[:len(lines) // 2])
+        inc.update_from_file(stock, partial)
+        with open(partial, "w") as f:
+            f.writelines(lines)
+        inc.update_from_file(stock, partial)
+
+    expected, failures = ind.sweep_lags(stocks, indicator_data, lags = lags, n_workers = 1)
+    assert len(failures) == 0
+    got = inc.correlations()
+    merged = expected.merge(got, on = ["Name", "indicator", "lag", "diff"])
+    assert len(merged) == len(expected) == len(got)
+    assert merged.r_x.isnull().any()
+    np.testing.assert_allclose(merged.r_y.values, merged.r_x.values, atol = 1e-10, equal_nan = True)
@@ -0,0 +1,28 @@
+# Logging set up by instrument.py, checked in a fresh interpreter.
+
+import os
+import subprocess
+import sys
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _run(code):
+    return subprocess.check_output([sys.executable, "-c", code], cwd = root, \
+            stderr = subprocess.STDOUT).decode("utf-8").strip()
+
+def test_import_only_adds_a_null_handler():
+    out = _run("import logging, instrument\n"
+            "logger = logging.getLogger('stocks')\n"
+            "print('%s %s %s' % ([type(h).__name__ for h in logger.handlers], logger.level, bool(logger.propagate)))")
+    assert out == "['NullHandler'] 0 True"
+
+def test_enable_logs_progress_to_stderr():
+    out = _run("import instrument\n"
+            "instrument.logger.info('hidden')\n"
+            "instrument.enable()\n"
+            "instrument.logger.info('progress')\n"
+            "instrument.disable()\n"
+            "instrument.logger.info('hidden')\n"
+            "instrument.logger.warning('failure')\n")
+    assert out.split() == ["progress", "failure"]
@@ -0,0 +1,30 @@
+# Lead-lag profiles against the per-lag correlations of sweep_lags.
+
+import numpy as np
+import pytest
+
+import definitions as dfn
+import indicator_correlation as ind
+
+
+@pytest.fixture
+def stocks(synthetic_stocks):
+    return synthetic_stocks(6, dfn.start_year - 1, dfn.end_year + 2)
+
+@pytest.mark.parametrize("diff", [False, True])
+def test_profiles_match_sweep_lags(stocks, diff):
+    indicator_data = ind.load_indicators()
+    lags = range(0, 14)
+    lead_lag, failures = ind.get_lead_lag(stocks, indicator_data, lags, diff, n_workers = 1)
+    sweep, sweep_failures = ind.sweep_lags(stocks, indicator_data, lags, [diff], n_workers = 1)
+    assert len(lead_lag.stocks) > 0
+    assert sorted(failures.Name) == sorted(sweep_failures.Name)
+
+    sweep = sweep[sweep.Name.isin(lead_lag.stocks)]
+    assert len(sweep) == lead_lag.r.size
+    rows = sweep.Name.map(dict((st, i) for i, st in enumerate(lead_lag.stocks))).values
+    columns = sweep.indicator.map(dict((c, i) for i, c in enumerate(lead_lag.indicators))).values
+    r = lead_lag.r[rows, columns, sweep.lag.values]
+    assert (sweep.lag > 0).any() and np.isfinite(r[sweep.lag.values > 0]).any()
+    np.testing.assert_array_equal(np.isnan(r), np.isnan(sweep.r.values))
+    np.testing.assert_allclose(r, sweep.r.values, atol = 1e-10)
@@ -0,0 +1,46 @@
+# Plots drawn on the Agg canvas, without a display.
+
+import numpy as np
+
+import plotting
+import utils as u
+
+
+def _axes():
+    return plotting.headless_figure().add_subplot(1, 1, 1)
+
+def test_monthly_data_has_one_line_per_series():
+    ax = _axes()
+    u.plot_monthly_data([[1.0, 2.0, 3.0], [2.0, 1.0, np.nan, 4.0]], 2010, 1, 2010, 4, axes_object = ax)
+    assert [len(line.get_xdata()) for line in ax.get_lines()] == [3, 4]
+    ax = _axes()
+    u.plot_quarterly_data([1.0, 2.0, 3.0, 4.0], 2010, 1, 2010, 4, axes_object = ax)
+    assert len(ax.get_lines()) == 1
+
+def test_stock_data_legend_names_every_stock():
+    ax = _axes()
+    u.plot_stock_data(["aaa", "bbb"], 0, scaled = True, axes_object = ax, \
+            stock_data = [np.arange(1.0, 85.0), np.arange(2.0, 86.0)])
+    legend = ax.legend()
+    assert [t.get_text() for t in legend.get_texts()] == ["aaa", "bbb"]
+    np.testing.assert_allclose(np.mean(ax.get_lines()[0].get_ydata()), 1.0)
+
+def test_stock_data_from_a_series_of_names():
+    # As in the notebook, names selected from a dataframe column keep their index.
+    import pandas as pd
+    stocks = pd.Series(["aaa", "bbb", "ccc"], index = [3, 7, 9])
+    ax = _axes()
+    u.plot_stock_data(stocks, 0, axes_object = ax, stock_data = np.ones((3, 84)))
+    assert [t.get_text() for t in ax.legend().get_texts()] == ["aaa", "bbb", "ccc"]
+
+def test_series_drawn_as_one_collection():
+    ax = _axes()
+    plotting.plot_series(np.ones((5, 12)), "month", 2010, 1, 2010, 12, axes_object = ax)
+    assert len(ax.collections) == 1 and len(ax.get_lines()) == 0
+
+def test_stock_matrix_without_stocks_read(tmpdir, monkeypatch):
+    monkeypatch.chdir(str(tmpdir))
+    data, names, window = plotting.stock_matrix(["missing"], lag = 1, n_workers = 1)
+    start_year, start_month, end_year, end_month = window
+    assert names == []
+    assert data.shape == (0, (end_year - start_year) * 12 + end_month - start_month + 1)
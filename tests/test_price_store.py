@@ -0,0 +1,80 @@
+# Monthly means read from the price store against those parsed from the stock
+# files, for months with empty Close values and months without entries.
+
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+import price_store as ps
+import utils as u
+
+
+def _rewrite_month(path, month, close = None):
+    # Empty the Close values of the rows of a month ("2012-05"), or drop the rows if close is None.
+    with open(path) as f:
+        lines = f.readlines()
+    header = lines[0].strip().split(",")
+    column = header.index("Close")
+    rows = [lines[0]]
+    for line in lines[1:]:
+        if not line.startswith(month):
+            rows.append(line)
+        elif close is not None:
+            fields = line.rstrip("\n").split(",")
+            fields[column] = close
+            rows.append(",".join(fields) + "\n")
+    with open(path, "w") as f:
+        f.writelines(rows)
+
+def _both_paths(stock, *args):
+    # Result or exception type from the store, then from the stock file.
+    results = []
+    for use_store in [True, False]:
+        if not use_store:
+            shutil.rmtree(ps.default_store_dir)
+        try:
+            results.append(u.get_stock_period_data(stock, *args).tolist())
+        except ValueError as e:
+            results.append(type(e))
+    return results
+
+@pytest.fixture
+def stocks(synthetic_stocks, monkeypatch):
+    names = synthetic_stocks(2, 2011, 2013, indicators = False, seed = 3, nan_rate = 0, late_start_rate = 0)
+    # Stores are kept open by folder name, which is the same in every test.
+    monkeypatch.setattr(ps, "_open_stores", {})
+    _rewrite_month(os.path.join("data", "stocks", names[0] + ".us.txt"), "2012-05", close = "")
+    _rewrite_month(os.path.join("data", "stocks", names[1] + ".us.txt"), "2012-05")
+    ps.build_store()
+    return names
+
+def test_month_of_empty_close_values_is_nan(stocks):
+    from_store, from_file = _both_paths(stocks[0], "month", 2012, 1, 2012, 12)
+    assert np.isnan(from_store[4]) and np.isnan(from_file[4])
+    np.testing.assert_allclose(from_store, from_file, equal_nan = True)
+
+def test_month_without_entries_raises(stocks):
+    assert _both_paths(stocks[1], "month", 2012, 1, 2012, 12) == [ValueError, ValueError]
+
+def _stages(stock, *args):
+    import instrument
+    instrument.reset()
+    instrument.enable(progress = False)
+    try:
+        result = u.get_stock_period_data(stock, *args)
+    finally:
+        instrument.disable()
+    return result, set(e["name"] for e in instrument.drain())
+
+def test_changed_stock_file_is_parsed_again(stocks):
+    result, stages = _stages(stocks[0], "month", 2013, 1, 2013, 12)
+    assert "read store" in stages and "read csv" not in stages
+    path = os.path.join("data", "stocks", stocks[0] + ".us.txt")
+    with open(path, "a") as f:
+        f.write("2013-12-31,1,1,1,1000000,1,0\n")
+    changed, stages = _stages(stocks[0], "month", 2013, 1, 2013, 12)
+    assert "read csv" in stages and "read store" not in stages
+    assert changed[-1] > 100 * result[-1]
+    np.testing.assert_allclose(changed[:-1], result[:-1])
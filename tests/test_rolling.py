@@ -0,0 +1,25 @@
+# Rolling correlations on synthetic stock and indicator files.
+
+import pytest
+
+import definitions as dfn
+import indicator_correlation as ind
+
+
+@pytest.fixture
+def stocks(synthetic_stocks):
+    return synthetic_stocks(2, dfn.start_year, dfn.end_year + 1)
+
+def test_quarterly_windows_end_in_their_last_month(stocks):
+    res, failures = ind.get_rolling_correlations(stocks, 4, "quarter", n_workers = 1)
+    assert len(failures) == 0
+    assert res.r.shape[2] == len(res.window_ends)
+    assert str(res.window_ends[0]) == "%d-12" % dfn.start_year
+    assert str(res.window_ends[-1]) == "%d-12" % dfn.end_year
+
+def test_no_stocks_read(stocks):
+    res, failures = ind.get_rolling_correlations(["missing"], 12, n_workers = 1)
+    assert len(failures) == 1
+    assert res.stocks == []
+    assert res.r.shape == (0, len(res.indicators), len(res.window_ends))
+    assert str(res.window_ends[0]) == "%d-12" % dfn.start_year
@@ -0,0 +1,59 @@
+# Permutation p-values and bootstrap intervals on seeded random series.
+
+import warnings
+
+import numpy as np
+
+import significance as sg
+
+
+def _ar1(rng, n_rows, n_periods, phi):
+    e = rng.randn(n_rows, n_periods)
+    x = np.zeros_like(e)
+    for t in range(n_periods):
+        x[:, t] = (phi * x[:, t - 1] if t > 0 else 0) + e[:, t]
+    return x
+
+def test_pvalues_are_calibrated_on_independent_autocorrelated_series():
+    # Monthly price levels are close to random walks (phi = 1), which shuffling
+    # single periods flags as significant for most unrelated pairs.
+    rng = np.random.RandomState(0)
+    for phi in [1.0, 0.9, 0.0]:
+        x = _ar1(rng, 300, 84, phi)
+        y = _ar1(rng, 10, 84, phi)
+        r, p_values = sg.permutation_pvalues(x, y)
+        assert 0.025 <= (p_values < 0.05).mean() <= 0.075, phi
+
+def test_pvalues_detect_related_series():
+    rng = np.random.RandomState(1)
+    y = rng.randn(3, 84).cumsum(axis = 1)
+    x = y + 0.5 * rng.randn(3, 84)
+    r, p_values = sg.permutation_pvalues(x, y)
+    assert (np.diag(p_values) < 0.05).all()
+    np.testing.assert_allclose(r, np.corrcoef(x, y)[:3, 3:], atol = 1e-12)
+
+def test_shifts_keep_the_series():
+    perms = sg.permutations(1000, 12)
+    assert perms.shape == (23, 12)
+    assert len(set(map(tuple, perms))) == 23 and tuple(range(12)) not in set(map(tuple, perms))
+    assert len(sg.permutations(10, 12, seed = 3)) == 10
+
+def test_missing_periods_give_nan_without_warnings():
+    rng = np.random.RandomState(2)
+    x = rng.randn(4, 40)
+    y = rng.randn(2, 40)
+    y[1, 5] = np.nan
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        r, p_values = sg.permutation_pvalues(x, y, n_permutations = 50)
+    assert np.isnan(p_values[:, 1]).all() and not np.isnan(p_values[:, 0]).any()
+
+def test_bootstrap_intervals_cover_the_correlation():
+    rng = np.random.RandomState(3)
+    y = rng.randn(2, 84).cumsum(axis = 1)
+    x = np.vstack([y + rng.randn(2, 84), rng.randn(3, 84).cumsum(axis = 1)])
+    r, p_values = sg.permutation_pvalues(x, y)
+    low, high = sg.bootstrap_intervals(x, y, n_resamples = 500)
+    assert (low <= high).all()
+    assert ((low <= r + 1e-12) & (r - 1e-12 <= high)).mean() > 0.8
+    assert (low[[0, 1], [0, 1]] > 0.5).all()
@@ -0,0 +1,32 @@
+# Checkpointed universe runs on synthetic stock and indicator files.
+
+import pytest
+
+import definitions as dfn
+import indicator_correlation as ind
+import results_io
+import universe
+
+
+@pytest.fixture
+def stocks(synthetic_stocks):
+    return synthetic_stocks(4, dfn.start_year - 1, dfn.end_year + 1)
+
+def test_memory_budget_too_small(stocks):
+    assert universe.plan_memory(stocks, 1024, 2) == (2, 500)
+    with pytest.raises(ValueError):
+        universe.plan_memory(stocks, 100, 2)
+
+def test_resume_checks_parameters(stocks, tmpdir):
+    out = str(tmpdir.join("results"))
+    indicator_data = ind.load_indicators()
+    counts = universe.run_universe(stocks[:2], out, indicator_data, 1, n_workers = 1)
+    assert counts["processed"] + counts["failed"] == 2
+    counts = universe.run_universe(stocks, out, indicator_data, 1, n_workers = 1)
+    assert counts["skipped"] == 2 and counts["processed"] + counts["failed"] == 2
+    assert results_io.read_manifest(out)["parameters"]["lag"] == 1
+    for lag, diff in [(3, False), (1, True)]:
+        with pytest.raises(ValueError):
+            universe.run_universe(stocks, out, indicator_data, lag, diff, n_workers = 1)
+    counts = universe.run_universe(stocks, out, indicator_data, 3, n_workers = 1, resume = False)
+    assert counts["skipped"] == 0
@@ -0,0 +1,143 @@
+# Correlation features for any set of stock files, such as the whole Kaggle dataset
+# (about 8,000 stocks and ETFs), in bounded memory.
+# - Tickers are given as a list, a ticker list file or a glob over data/stocks.
+# - Results are written to a results folder (see results_io.py) in chunks of stocks as
+#   they finish, with the failures among them.
+# - The folder is also the checkpoint: stocks already written or failed are skipped
+#   when a run is started again on the same folder, so an interrupted run resumes.
+# - max_memory_mb bounds the number of worker processes and of stocks buffered in the
+#   parent, from estimates of the memory a worker needs to read the largest stock file.
+#   python universe.py --out results/universe_lag_1 --lag 1 --glob "*" --max-memory-mb 2048
+
+import argparse
+import fnmatch
+import glob
+import logging
+import multiprocessing
+import os
+
+import definitions as dfn
+import instrument
+import results_io
+import utils as u
+from aligned import as_aligned
+
+stock_file_suffix = ".us.txt"
+default_stocks_dir = "data/stocks"
+
+# Memory estimates, in bytes: a worker process with numpy and pandas loaded, the
+# parsed copy of a stock file per byte of the file, and the monthly and quarterly
+# series of a stock waiting in the parent to be correlated.
+worker_base_bytes = 80 * 1024 * 1024
+parse_bytes_per_file_byte = 10
+buffered_bytes_per_stock = 8 * 1024
+
+
+# ********** Choosing tickers **********
+
+# Tickers of the stock files in stocks_dir whose name matches pattern (e.g. "a*"), sorted.
+def find_tickers(pattern = "*", stocks_dir = default_stocks_dir):
+    tickers = [os.path.basename(path)[:-len(stock_file_suffix)] \
+            for path in glob.glob(os.path.join(stocks_dir, "*" + stock_file_suffix))]
+    return sorted(t for t in tickers if fnmatch.fnmatch(t, pattern))
+
+# Tickers listed in a file: a CSV file with a Name column (as data/S&P_stocks.csv),
+# or a text file with one ticker per line.
+def read_ticker_list(path):
+    with open(path) as f:
+        lines = [line.strip() for line in f if line.strip()]
+    if len(lines) == 0:
+        return []
+    header = lines[0].split(",")
+    if "Name" in header:
+        column = header.index("Name")
+        return [line.split(",")[column].replace(".", "-") for line in lines[1:]]
+    return lines
+
+
+# ********** Memory budget **********
+
+# Number of workers and stocks per chunk that fit in max_memory_mb, for the given stocks.
+# Raises a ValueError if max_memory_mb cannot hold the parent process, one worker and one stock.
+def plan_memory(stocks, max_memory_mb, n_workers = None, chunk_size = 500, stocks_dir = default_stocks_dir):
+    if n_workers is None:
+        n_workers = multiprocessing.cpu_count()
+    sizes = [os.path.getsize(p) for p in \
+            (os.path.join(stocks_dir, st + stock_file_suffix) for st in stocks) if os.path.exists(p)]
+    worker_bytes = worker_base_bytes + parse_bytes_per_file_byte * max(sizes or [0])
+    budget = max_memory_mb * 1024 * 1024
+    needed = 2 * worker_bytes + buffered_bytes_per_stock
+    if budget < needed:
+        raise ValueError("max_memory_mb of %d MB is below the %d MB needed by the parent and one worker." % \
+                (max_memory_mb, -(-needed // (1024 * 1024))))
+    # Workers, counting the parent process as one, get up to three quarters of the budget,
+    # and the rest is for stocks buffered in the parent.
+    n_workers = max(1, min(n_workers, int(0.75 * budget // worker_bytes) - 1))
+    buffer_bytes = budget - (n_workers + 1) * worker_bytes
+    chunk_size = max(1, min(chunk_size, int(buffer_bytes // buffered_bytes_per_stock)))
+    return n_workers, chunk_size
+
+
+# ********** Checkpointed runs **********
+
+# Stocks already written to a results folder, or recorded there as failed.
+def finished_stocks(out):
+    if not results_io.is_results_folder(out):
+        return set()
+    done = set(results_io.read_failures(out).Name)
+    if results_io.read_manifest(out)["columns"] is not None:
+        done.update(results_io.read_results(out, columns = ["Name"]).Name)
+    return done
+
+# Correlation features of stocks with the indicators, for a lag in months, written to the
+# results folder out in chunks. Stocks already in out are skipped unless resume is False,
+# in which case the folder is started again. lag, diff and the indicators are recorded in
+# the folder, and resuming with others raises a ValueError.
+# With retry_failures, stocks that failed in an earlier run are tried again.
+# Returns the number of stocks processed, failed and skipped in this run.
+def run_universe(stocks, out, indicator_data, lag, diff = False, n_workers = None, max_memory_mb = 1024, \
+        chunk_size = 500, resume = True, retry_failures = False):
+    import indicator_correlation as ind
+    indicator_data = as_aligned(indicator_data)
+    columns = ["Name"] + sorted(dfn.indicators[i]["df column"] for i in indicator_data.keys())
+    writer = results_io.ResultsWriter(out, append = resume)
+    writer.check_parameters({"lag" : lag, "diff" : bool(diff), "columns" : columns})
+    if retry_failures:
+        writer.clear_failures()
+    done = finished_stocks(out) if resume else set()
+    todo = [st for st in stocks if st not in done]
+    n_workers, chunk_size = plan_memory(todo, max_memory_mb, n_workers, chunk_size)
+    instrument.logger.info("%d stocks to process, %d already done, %d workers, chunks of %d stocks", \
+            len(todo), len(stocks) - len(todo), n_workers, chunk_size)
+
+    collector = results_io.ChunkCollector(lambda pending: ind.correlation_frame(pending, indicator_data, columns), \
+            columns, writer, chunk_size)
+    u.run_batch(ind.get_stock_data_for_correlation, todo, (lag, diff), n_workers, \
+            on_result = collector.add_result, on_failure = collector.add_failure)
+    collector.flush()
+    return {"processed" : collector.processed, "failed" : collector.failed, "skipped" : len(stocks) - len(todo)}
+
+
+def main():
+    import indicator_correlation as ind
+    parser = argparse.ArgumentParser(description = "Correlation features for any set of stock files.")
+    parser.add_argument("--out", required = True, help = "Results folder, also used to resume the run.")
+    parser.add_argument("--lag", type = int, default = 1, help = "Lag in months.")
+    parser.add_argument("--diff", action = "store_true")
+    parser.add_argument("--glob", default = "*", help = "Pattern of tickers in the stocks folder.")
+    parser.add_argument("--tickers", help = "File listing the tickers, instead of --glob.")
+    parser.add_argument("--workers", type = int, default = None)
+    parser.add_argument("--max-memory-mb", type = int, default = 1024)
+    parser.add_argument("--chunk-size", type = int, default = 500)
+    parser.add_argument("--restart", action = "store_true", help = "Start again instead of resuming.")
+    parser.add_argument("--retry-failures", action = "store_true")
+    args = parser.parse_args()
+
+    stocks = read_ticker_list(args.tickers) if args.tickers else find_tickers(args.glob)
+    instrument.log_to_stderr(logging.INFO)
+    counts = run_universe(stocks, args.out, ind.indicator_data, args.lag, args.diff, args.workers, \
+            args.max_memory_mb, args.chunk_size, not args.restart, args.retry_failures)
+    print("Processed %(processed)d stocks, %(failed)d failed, %(skipped)d skipped." % counts)
+
+if __name__ == "__main__":
+    main()
@@ -1,121 +1,205 @@
+import multiprocessing
+import os
+
 import numpy as np
-import pandas as pd
-import matplotlib.pyplot as plt
-import math
 import definitions as dfn
+import instrument
 
 # ********** Getting date-specific entries from data series **********
 
+# Sorted index of a date series, built once, to answer date range queries by binary search.
+# If a data series is given, prefix sums of its values (skipping NaN) are kept as well,
+# so the mean over any date range costs O(log n).
+class DateIndex(object):
+
+    def __init__(self, date_col, data_col = None):
+        dates = np.asarray(date_col).astype("datetime64[ns]")
+        # Missing dates are left out of the index.
+        valid = np.flatnonzero(~np.isnat(dates))
+        self.order = valid[np.argsort(dates[valid], kind = "mergesort")]
+        self.dates = dates[self.order]
+        if data_col is not None:
+            data = np.asarray(data_col, dtype = np.float64)[self.order]
+            self.values = data
+            self.cum_sums = np.concatenate([[0.0], np.cumsum(np.where(np.isnan(data), 0.0, data))])
+            self.cum_counts = np.concatenate([[0], np.cumsum(~np.isnan(data))])
+
+    def __len__(self):
+        return len(self.dates)
+
+    # Start and stop positions in the sorted index of dates within [start_dates, end_dates].
+    # Accepts single dates or arrays of dates.
+    def bounds(self, start_dates, end_dates):
+        start_dates = np.asarray(start_dates).astype("datetime64[ns]")
+        end_dates = np.asarray(end_dates).astype("datetime64[ns]")
+        return np.searchsorted(self.dates, start_dates, side = "left"), \
+                np.searchsorted(self.dates, end_dates, side = "right")
+
+    # Contiguous slice of the sorted index with the dates in the range.
+    def range(self, start_date, end_date):
+        start, stop = self.bounds(start_date, end_date)
+        return slice(int(start), max(int(start), int(stop)))
+
+    # Positions in the original series of the dates in the range, in order of position.
+    def positions(self, start_date, end_date):
+        return np.sort(self.order[self.range(start_date, end_date)])
+
+    # Data values in the range, in date order (a view, no copy).
+    def values_in_range(self, start_date, end_date):
+        return self.values[self.range(start_date, end_date)]
+
+    # Mean of the data (skipping NaN) in each range [start_dates[i], end_dates[i]],
+    # NaN for ranges without data.
+    def means(self, start_dates, end_dates):
+        start, stop = self.bounds(start_dates, end_dates)
+        stop = np.maximum(start, stop)
+        counts = self.cum_counts[stop] - self.cum_counts[start]
+        with np.errstate(invalid = "ignore", divide = "ignore"):
+            return (self.cum_sums[stop] - self.cum_sums[start]) / counts
+
+    def mean(self, start_date, end_date):
+        return float(self.means(start_date, end_date))
+
 # Find indices in date column that fall within the specified time range.
 def find_dates_in_range(date_col, start_date, end_date):
     if str(type(date_col)).find("Series") < 0:
         raise ValueError("Expecting a pandas series with dates, got " + str(type(date_col)) + ".")
-    dates_in_range = date_col.apply(lambda x : x >= start_date and x <= end_date)
-    if not dates_in_range.any():
+    positions = DateIndex(date_col).positions(start_date, end_date)
+    if len(positions) == 0:
         raise ValueError("No dates found in range")
-    return np.where(dates_in_range)
+    return (positions,)
 
 # Mean of a data series across a specified date range.
+# For many ranges over the same series, build a DateIndex once and use its means method.
 def mean_in_date_range(data_col, date_col, start_date, end_date):
     if str(type(data_col)).find("Series") < 0:
         raise ValueError("Expecting a pandas series with data, got  " + str(type(data_col)) + ".")
-    if str(type(data_col)).find("Series") < 0:
+    if str(type(date_col)).find("Series") < 0:
         raise ValueError("Expecting a pandas series with date, got  " + str(type(date_col)) + ".")
-    data_in_range = data_col.iloc[find_dates_in_range(date_col, start_date, end_date)].dropna()
-    return data_in_range.mean()
+    index = DateIndex(date_col, data_col)
+    in_range = index.range(start_date, end_date)
+    if in_range.stop == in_range.start:
+        raise ValueError("No dates found in range")
+    return index.mean(start_date, end_date)
 
-def mean_year_month(data_col, date_col, start_year, start_month, end_year, end_month):
-    # Create a dictionary of mean values sorted by year and month.
+# ********** Calendar aggregation of data series **********
+
+# Number of periods in a year for each time resolution.
+periods_per_year = {"month" : 12, "quarter" : 4, "year" : 1}
+
+# Index of the calendar period (month, quarter or year) of each date,
+# counted from the first period of year 0. Missing dates (NaT) get a negative index.
+def period_index(date_col, period):
+    if not periods_per_year.has_key(period):
+        raise ValueError("Period should be one of %s, got %s." % (sorted(periods_per_year.keys()), period))
+    months = np.asarray(date_col).astype("datetime64[M]")
+    index = months.astype(np.int64) + 1970 * 12
+    index[np.isnat(months)] = -1
+    return index // (12 // periods_per_year[period])
+
+# Mean of a data series in each calendar period between (start_year, start_period) and
+# (end_year, end_period), inclusive. Periods are months (1-12), quarters (1-4) or years.
+# NaN values are skipped. A period with no entries at all raises a ValueError,
+# unless allow_missing is set, in which case its mean is NaN.
+def mean_by_period(data_col, date_col, period, start_year, start_period, end_year, end_period, \
+        allow_missing = False):
+    return period_means(data_col, period_index(date_col, period), period, start_year, start_period, \
+            end_year, end_period, allow_missing)
+
+# Same as mean_by_period, with the period index of each entry already computed.
+def period_means(data_col, index, period, start_year, start_period, end_year, end_period, \
+        allow_missing = False):
+    n_periods = periods_per_year[period]
+    first = start_year * n_periods + start_period - 1
+    n = end_year * n_periods + end_period - first
+    if n <= 0:
+        return np.zeros(0)
+
+    # Bucket every entry by its offset from the first requested period.
+    keys = np.asarray(index) - first
+    data = np.asarray(data_col, dtype = np.float64)
+    in_range = (keys >= 0) & (keys < n)
+    keys = keys[in_range]
+    data = data[in_range]
+    valid = ~np.isnan(data)
+    counts = np.bincount(keys[valid], minlength = n)
+    sums = np.bincount(keys[valid], weights = data[valid], minlength = n)
+    entries = np.bincount(keys, minlength = n)
+
+    if not allow_missing and not entries.all():
+        missing = first + np.flatnonzero(entries == 0)[0]
+        year, p = divmod(missing, n_periods)
+        if period == "year":
+            raise ValueError("No data for year %s." % year)
+        raise ValueError("No data for year %s, %s %s." % (year, period, p + 1))
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        return sums / counts
+
+def _check_series(data_col, date_col):
     if str(type(data_col)).find("Series") < 0:
         raise ValueError("Expecting a pandas series with data, got  " + str(type(data_col)) + ".")
-    if str(type(data_col)).find("Series") < 0:
+    if str(type(date_col)).find("Series") < 0:
         raise ValueError("Expecting a pandas series with date, got  " + str(type(date_col)) + ".")
-    dict = {}
-    for d in range(0, len(date_col)):
-        date = date_col[d];
-        if not dict.has_key(date.year):
-            dict[date.year] = {}
-        if not dict[date.year].has_key(date.month):
-            dict[date.year][date.month] = []
-        # Put data entry in the bucket for current year and month.
-        if not math.isnan(data_col[d]):
-            dict[date.year][date.month].append(data_col[d])
-    
-    # Output is the mean of each bucket in the requested range.
-    output = [];
-    for y in range(start_year, end_year + 1):
-        if y > start_year:
-            start_month_for_year = 1
-        else:
-            start_month_for_year = start_month
-        if y < end_year:
-            end_month_for_year = 12;
-        else:
-            end_month_for_year = end_month;
-        for m in range(start_month_for_year, end_month_for_year + 1):
-            if (not dict.has_key(y)) or (not dict[y].has_key(m)):
-                raise ValueError("No data for year %s, month %s." % (y, m))
-            output.append(np.mean(dict[y][m]))
-    return output
 
+# List of monthly means in the requested range.
+def mean_year_month(data_col, date_col, start_year, start_month, end_year, end_month):
+    _check_series(data_col, date_col)
+    return mean_by_period(data_col, date_col, "month", start_year, start_month, \
+            end_year, end_month).tolist()
+
+# List of quarterly means in the requested range.
 def mean_year_quarter(data_col, date_col, start_year, start_quarter, end_year, end_quarter):
-    # Create a dictionary of mean values sorted by year and quarter.
-    if str(type(data_col)).find("Series") < 0:
-        raise ValueError("Expecting a pandas series with data, got  " + str(type(data_col)) + ".")
-    if str(type(data_col)).find("Series") < 0:
-        raise ValueError("Expecting a pandas series with date, got  " + str(type(date_col)) + ".")
-    dict = {}
-    for d in range(0, len(date_col)):
-        date = date_col[d];
-        quarter = (date.month -1) / 3 + 1
-        if not dict.has_key(date.year):
-            dict[date.year] = {}
-        if not dict[date.year].has_key(quarter):
-            dict[date.year][quarter] = []
-        # Put data entry in the bucket for current year and quarter.
-        if not math.isnan(data_col[d]):
-            dict[date.year][quarter].append(data_col[d])
-    
-    # Output is the mean of each bucket in the requested range.
-    output = [];
-    for y in range(start_year, end_year + 1):
-        if y > start_year:
-            start_quarter_for_year = 1
-        else:
-            start_quarter_for_year = start_quarter
-        if y < end_year:
-            end_quarter_for_year = 4;
-        else:
-            end_quarter_for_year = end_quarter;
-        for q in range(start_quarter_for_year, end_quarter_for_year + 1):
-            if (not dict.has_key(y)) or (not dict[y].has_key(q)):
-                raise ValueError("No data for year %s, quarter %s." % (y, q))
-            output.append(np.mean(dict[y][q]))
-    return output
+    _check_series(data_col, date_col)
+    return mean_by_period(data_col, date_col, "quarter", start_year, start_quarter, \
+            end_year, end_quarter).tolist()
 
 
 # ********** Helpers for parsing months, quarters etc. **********
 
+# Mean closing price of a stock in each month or quarter of the requested range.
+# Reads from the price store (see price_store.py) when it has the stock and the stock
+# file has not changed since the store was built (or has been removed), otherwise
+# parses the stock file. See period_means for allow_missing.
+def get_stock_period_data(stock_file, period, start_year, start_period, end_year, end_period, \
+        allow_missing = False):
+    import price_store as ps
+    path = "data/stocks/" + stock_file + ".us.txt"
+    store = ps.open_store()
+    if store is not None and stock_file in store and \
+            (not os.path.exists(path) or store.is_current(stock_file, path)):
+        with instrument.stage("read store", stock_file) as s:
+            close, index = store.close_by_period(stock_file, period)
+            s.rows = len(close)
+            s.bytes = close.nbytes
+        with instrument.stage("mean by %s" % period, stock_file, rows = len(close)):
+            return period_means(close, index, period, start_year, start_period, end_year, end_period, \
+                    allow_missing)
+    import pandas as pd
+    with instrument.stage("read csv", stock_file) as s:
+        stock = pd.read_csv(path)
+        stock_close = pd.to_numeric(stock.Close, errors = "coerce")
+        s.rows = len(stock)
+        s.bytes = os.path.getsize(path)
+    with instrument.stage("convert dates", stock_file, rows = len(stock)):
+        stock_date = pd.to_datetime(stock.Date, format = "%Y-%m-%d")
+    with instrument.stage("mean by %s" % period, stock_file, rows = len(stock)):
+        return mean_by_period(stock_close, stock_date, period, start_year, start_period, end_year, end_period, \
+                allow_missing)
+
 def get_stock_monthly_data(stock_file, start_year, start_month, end_year, end_month):
     try:
-        stock = pd.read_csv("data/stocks/" + stock_file + ".us.txt")
-        stock_close = pd.to_numeric(stock.Close, errors = "coerce")
-        stock_date = pd.to_datetime(stock.Date)
-        stock_monthly_data = mean_year_month(stock_close, stock_date, start_year, \
-                start_month, end_year, end_month)
-    except:
-        raise StandardError("Problem getting monthly data for stock %s" % stock_file)
+        stock_monthly_data = get_stock_period_data(stock_file, "month", start_year, \
+                start_month, end_year, end_month).tolist()
+    except Exception as e:
+        raise StandardError("Problem getting monthly data for stock %s: %s" % (stock_file, e))
     return stock_monthly_data
 
 def get_stock_quarterly_data(stock_file, start_year, start_quarter, end_year, end_quarter):
     try:
-        stock = pd.read_csv("data/stocks/" + stock_file + ".us.txt")
-        stock_close = pd.to_numeric(stock.Close, errors = "coerce")
-        stock_date = pd.to_datetime(stock.Date)
-        stock_quarterly_data = mean_year_quarter(stock_close, stock_date, start_year, \
-                start_quarter, end_year, end_quarter)
-    except:
-        raise StandardError("Problem getting quarterly data for stock %s" % stock_file)
+        stock_quarterly_data = get_stock_period_data(stock_file, "quarter", start_year, \
+                start_quarter, end_year, end_quarter).tolist()
+    except Exception as e:
+        raise StandardError("Problem getting quarterly data for stock %s: %s" % (stock_file, e))
     return stock_quarterly_data
 
 # Figure out time ranges based on lag specified in months.
@@ -154,100 +238,120 @@ def months_in_quarter(quarter):
     return range(3 * quarter - 2, 3 * quarter + 1)
 
 def range_days_in_quarter(year, quarter):
+    import pandas as pd
     months = months_in_quarter(quarter)
     start_date = pd.datetime(year, months[0], 1)
-    end_date = pd.datetime(year, months[2], num_days_in_month(months[2]))
+    end_date = pd.datetime(year, months[2], num_days_in_month(months[2], year))
     return start_date, end_date
 
 
+# ********** Batch engine for per-stock work **********
+
+# Arguments shared by all tasks in a worker process, set once by the pool initializer
+# so that the indicator data is not pickled again for every stock.
+_batch_func = None
+_batch_args = ()
+
+def _init_batch_worker(func, args, instrumented = False):
+    global _batch_func, _batch_args
+    _batch_func = func
+    _batch_args = args
+    instrument.enabled = instrumented
+
+# Events recorded while processing a stock are returned with its result, so that
+# the parent process can report them.
+def _run_batch_task(stock):
+    try:
+        with instrument.stage("stock", stock):
+            result = _batch_func(stock, *_batch_args)
+        return stock, result, None, instrument.drain()
+    except Exception as e:
+        return stock, None, {"Name": stock, "error": type(e).__name__, "reason": str(e)}, instrument.drain()
+
+# Apply func(stock, *args) to every stock, in a pool of n_workers processes.
+# func must be a module-level function so it can be sent to the workers.
+# Results are returned in the order of the stocks, with failures collected separately
+# as dictionaries rather than stopping the run. If on_result is given, it is called
+# with each stock and its result as they arrive instead, and no results are kept.
+# on_failure is likewise called with each failure as it arrives.
+# Progress and failures are reported on the logger of instrument.py, naming the tasks
+# with label (e.g. "stocks") and each task with item, a format for the task (e.g. "stock %s").
+def run_batch(func, stocks, args = (), n_workers = None, chunksize = 4, on_result = None, on_failure = None, \
+        label = "stocks", item = "stock %s"):
+    if n_workers is None:
+        n_workers = multiprocessing.cpu_count()
+    rows = []
+    failures = []
+    progress = instrument.Progress(len(stocks) if hasattr(stocks, "__len__") else "?", label, item = item)
+    if n_workers <= 1:
+        _init_batch_worker(func, args, instrument.enabled)
+        results = (_run_batch_task(st) for st in stocks)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(n_workers, initializer = _init_batch_worker, \
+                initargs = (func, args, instrument.enabled))
+        results = pool.imap(_run_batch_task, stocks, chunksize)
+    try:
+        for st, result, failure, events in results:
+            instrument.add_events(events)
+            if failure is None and on_result is not None:
+                on_result(st, result)
+            elif failure is None:
+                rows.append(result)
+            else:
+                failures.append(failure)
+                if on_failure is not None:
+                    on_failure(failure)
+            progress.update(st, failure)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return rows, failures
+
+
 # ********** Helpers for plots **********
     
-def plot_stock_data(stock_files, lag, scaled = False, axes_object = ""):
+def plot_stock_data(stock_files, lag, scaled = False, axes_object = "", stock_data = None):
     # Plot stock data vs. time in months.
     # stock_files is a string or a list of strings representing a ticker symbol.
     # lag is time lag in months relative to the time frame defined in definitions.py.
     # Optionally, scale data by the mean of each stock for better visibility.
+    # stock_data: monthly data of the stocks if already read (e.g. with plotting.stock_matrix),
+    # so that plotting them again does not read the stock files.
+    import plotting
 
     if type(stock_files) is str:
         stock_files = [stock_files]
 
-    if axes_object == "":
-        fig, ax = plt.subplots(1, 1)
-    else:
-        ax = axes_object
-
     sy, sm, ey, em = apply_lag_in_months(dfn.start_year, dfn.end_year, lag)
-    plot_data = []
-    for stock_file in stock_files:
-        st = get_stock_monthly_data(stock_file, sy, sm, ey, em)
-        if scaled:
-            st = (st / np.mean(st)).tolist()
-        plot_data.append(st)
-    plot_monthly_data(plot_data, sy, sm, ey, em, axes_object = ax, \
-            ylabel = ("scaled " * scaled) + "stock price")
+    if stock_data is None:
+        stock_data = [get_stock_monthly_data(stock_file, sy, sm, ey, em) for stock_file in stock_files]
+    stock_data = plotting.series_list(stock_data)
+    if scaled:
+        stock_data = [plotting.scale_rows(st)[0] for st in stock_data]
+    return plotting.plot_lines(stock_data, "month", sy, sm, ey, em, axes_object, xlabel = "Month", \
+            ylabel = ("scaled " * scaled) + "stock price", labels = list(stock_files))
     
 # Get x-axis for plots of monthly data.
 def get_x_axis_monthly(start_year, start_month, end_year, end_month):
-    answer = []
-    for m in range(start_month, 13):
-        answer.append("%s/%s" % (str(start_year), str(m)))
-    for y in range(start_year + 1, end_year):
-        for m in range(1, 13):
-            answer.append("%s/%s" % (str(y), str(m)))
-    for m in range(1, end_month + 1):
-        answer.append("%s/%s" % (str(end_year), str(m)))
-    return answer
+    import plotting
+    return list(plotting.axis_labels("month", start_year, start_month, end_year, end_month))
 
 # Get x-axis for plots of quarterly data.
 def get_x_axis_quarterly(start_year, start_quarter, end_year, end_quarter):
-    answer = []
-    for q in range(start_quarter, 5):
-        answer.append("%s/%s" % (str(start_year), str(q)))
-    for y in range(start_year + 1, end_year):
-        for q in range(1, 5):
-            answer.append("%s/%s" % (str(y), str(q)))
-    for q in range(1, end_quarter + 1):
-        answer.append("%s/%s" % (str(end_year), str(q)))
-    return answer
+    import plotting
+    return list(plotting.axis_labels("quarter", start_year, start_quarter, end_year, end_quarter))
 
+# Plot one or several series, one line each (see plotting.plot_lines).
 def plot_monthly_data(data, start_year, start_month, end_year, end_month, \
             axes_object = "", title = "", xlabel = "Month", ylabel = ""):
-    # Convert data to list of lists, so several lines could be plotted.
-    if not type(data[0]) is list:
-        data = [data]
-
-    if axes_object == "":
-        fig, ax = plt.subplots(1, 1)
-    else:
-        ax = axes_object
-
-    # plot data.
-    for data_line in data:
-        ax.plot(data_line)
-
-    # Set text on plot.
-    ax.set_title(title)
-    ax.set_xlabel(xlabel)
-    ax.set_ylabel(ylabel)
-    x_axis = get_x_axis_monthly(start_year, start_month, end_year, end_month)
-    x_axis_tick_labels = [0] + [x_axis[i] for i in ax.get_xticks()[1:-1].astype(int).tolist()]
-    ax.xaxis.set_ticklabels(x_axis_tick_labels)
-    return ax
+    import plotting
+    return plotting.plot_lines(data, "month", start_year, start_month, end_year, end_month, \
+            axes_object, title, xlabel, ylabel)
     
 def plot_quarterly_data(data, start_year, start_quarter, end_year, end_quarter, \
             axes_object = "", title = "", xlabel = "Quarter", ylabel = ""):
-    if not type(data[0]) is list:
-        data = [data]
-    if axes_object == "":
-        fig, ax = plt.subplots(1, 1)
-    else:
-        ax = axes_object
-    for data_line in data:
-        ax.plot(data_line)
-    ax.set_title(title)
-    ax.set_xlabel(xlabel)
-    ax.set_ylabel(ylabel)
-    x_axis = get_x_axis_quarterly(start_year, 1, end_year, 4)
-    x_axis_tick_labels = [0] + [x_axis[i] for i in ax.get_xticks()[1:-1].astype(int).tolist()]
-    ax.xaxis.set_ticklabels(x_axis_tick_labels)
-    return ax
\ No newline at end of file
+    import plotting
+    return plotting.plot_lines(data, "quarter", start_year, start_quarter, end_year, end_quarter, \
+            axes_object, title, xlabel, ylabel)